@@ -0,0 +1,110 @@
+from collections import Counter
+from django.db.models import Max, Min
+from django.utils.translation import gettext_lazy as _, ngettext
+from pretix.base.services.cart import CartError
+
+
+class CartSummary:
+    """
+    The subevents and items in a cart with their counts, gathered in a single pass
+    over the cart positions for all rules. Only ids are read, so no related objects
+    are loaded per position.
+    """
+
+    def __init__(self, positions):
+        self.subevent_ids = Counter()
+        self.item_ids = Counter()
+        for position in positions:
+            self.subevent_ids[position.subevent_id] += 1
+            self.item_ids[position.item_id] += 1
+        self.count = sum(self.item_ids.values())
+
+
+class CartRule:
+    """
+    A rule is enabled by a setting, whose value is passed to the rule. Rules are
+    set up once per event and request, ``check`` then raises a ``CartError`` if
+    the cart breaks the rule.
+    """
+
+    setting = None
+    as_type = int
+
+    def __init__(self, event, value):
+        self.value = value
+
+    def check(self, event, cart):
+        raise NotImplementedError()
+
+
+class SingleSubEventRule(CartRule):
+    setting = "block_multisubevent_checkout"
+    as_type = bool
+
+    def check(self, event, cart):
+        if len(cart.subevent_ids) > 1:
+            raise CartError(
+                _(
+                    "Sorry, you can only choose one event per order. "
+                    "Please create multiple orders to participate on multiple dates."
+                )
+            )
+
+
+class MaxSubEventsRule(CartRule):
+    setting = "max_subevents_per_order"
+
+    def check(self, event, cart):
+        if len(cart.subevent_ids) > self.value:
+            raise CartError(
+                ngettext(
+                    "Sorry, you can only choose one date per order.",
+                    "Sorry, you can only choose up to %(num)d dates per order.",
+                    self.value,
+                )
+                % {"num": self.value}
+            )
+
+
+class SubEventSpanRule(CartRule):
+    setting = "max_subevent_span_days"
+
+    def __init__(self, event, value):
+        super().__init__(event, value)
+        self.timezone = event.timezone
+
+    def check(self, event, cart):
+        if len(cart.subevent_ids) < 2:
+            return
+        dates = event.subevents.filter(pk__in=cart.subevent_ids).aggregate(
+            first=Min("date_from"), last=Max("date_from")
+        )
+        first = dates["first"].astimezone(self.timezone).date()
+        last = dates["last"].astimezone(self.timezone).date()
+        if (last - first).days >= self.value:
+            raise CartError(
+                ngettext(
+                    "Sorry, all dates of an order need to be on the same day.",
+                    "Sorry, all dates of an order need to be within %(num)d days.",
+                    self.value,
+                )
+                % {"num": self.value}
+            )
+
+
+RULES = [SingleSubEventRule, MaxSubEventsRule, SubEventSpanRule]
+
+
+def get_enabled_rules(event):
+    rules = []
+    for rule in RULES:
+        value = event.settings.get(rule.setting, as_type=rule.as_type)
+        if value:
+            rules.append(rule(event, value))
+    return rules
+
+
+def validate_cart_rules(event, rules, positions):
+    cart = CartSummary(positions)
+    for rule in rules:
+        rule.check(event, cart)
@@ -10,6 +10,9 @@ from pretix.base.settings import PERSON_NAME_SCHEMES
 from pretix.presale import checkoutflow
 from pretix.presale.views import CartMixin
 
+from .conf import PurpleSettings
+from .models import OnPremiseContact
+
 
 class ContactForm(forms.Form):
     required_css_class = "required"
@@ -61,6 +64,42 @@ class ContactForm(forms.Form):
         )
 
 
+ORDER_CONTACTS_MAXSIZE = 1024
+_order_contacts = OrderedDict()
+
+
+def get_order_contact(order):
+    """
+    Returns the labelled on premise contact of an order as returned by
+    ``ContactForm.label_formdata``, or ``None`` if the order has none.
+
+    Ticket layouts evaluate several contact variables for every position, and
+    exports load a new order object for each of them. The result is therefore
+    memoized per order and modification time, which saving or deleting a contact
+    updates. The returned dict is shared between callers and must not be
+    modified.
+    """
+    key = (order.pk, order.last_modified, order.event.settings.name_scheme)
+    try:
+        return _order_contacts[key]
+    except KeyError:
+        pass
+    try:
+        contact = order.purple_onpremise_contact
+    except OnPremiseContact.DoesNotExist:
+        labelled = None
+    else:
+        labelled = ContactForm.label_formdata(contact.formdata, order.event)
+    _order_contacts[key] = labelled
+    while len(_order_contacts) > ORDER_CONTACTS_MAXSIZE:
+        _order_contacts.popitem(last=False)
+    return labelled
+
+
+def invalidate_order_contacts():
+    _order_contacts.clear()
+
+
 class ContactStep(CartMixin, checkoutflow.TemplateFlowStep):
     identifier = "onpremisecontact"
     priority = 55
@@ -105,16 +144,12 @@ class ContactStep(CartMixin, checkoutflow.TemplateFlowStep):
 
     def is_applicable(self, request):
         self.request = request
-        optionalAndSelected = request.event.settings.get(
-            "onpremise_contact_availability", as_type=str
-        ) == "optional" and self.cart_session.get("contact_form_data", {}).get(
-            "has_onpremise_contact", False
-        )
-        alwaysAsk = (
-            request.event.settings.get("onpremise_contact_availability", as_type=str)
-            == "always"
-        )
-        return alwaysAsk or optionalAndSelected
+        availability = PurpleSettings.for_event(request.event).contact_availability
+        if availability == "always":
+            return True
+        return availability == "optional" and self.cart_session.get(
+            "contact_form_data", {}
+        ).get("has_onpremise_contact", False)
 
     def post(self, request):
         self.request = request
@@ -0,0 +1,67 @@
+from django.utils.functional import cached_property
+
+from .cartrules import get_enabled_rules
+from .style import css_checksum, custom_css_enabled
+
+
+class PurpleSettings:
+    """
+    Snapshot of the purpletweaks settings of an event. A single checkout request
+    passes through many receivers of this plugin, so the settings are read once
+    and kept on the event object, which pretix loads anew for every request.
+    Values that take more than a lookup are only computed when first needed.
+    """
+
+    def __init__(self, event):
+        self.event = event
+        self.contact_availability = (
+            event.settings.get("onpremise_contact_availability", as_type=str) or "never"
+        )
+        self.event_page_css = event.settings.get(
+            "event_page_css", default="", as_type=str
+        )
+
+    @cached_property
+    def cart_rules(self):
+        return get_enabled_rules(self.event) if self.event.has_subevents else []
+
+    @cached_property
+    def custom_css(self):
+        return bool(custom_css_enabled() and self.event_page_css.strip())
+
+    @cached_property
+    def custom_css_checksum(self):
+        return css_checksum(self.event_page_css)
+
+    @cached_property
+    def custom_css_file(self):
+        # Only use the published file if the CSS was not changed after publishing,
+        # e.g. through the API
+        if self.event.settings.get("purple_css_checksum") != self.custom_css_checksum:
+            return None
+        return self.event.settings.get("purple_css_file", as_type=str)
+
+    @classmethod
+    def for_event(cls, event):
+        try:
+            return event._purple_settings
+        except AttributeError:
+            event._purple_settings = cls(event)
+            return event._purple_settings
+
+    @staticmethod
+    def invalidate(event):
+        event.__dict__.pop("_purple_settings", None)
+
+    @property
+    def contact_enabled(self):
+        return self.contact_availability in ("optional", "always")
+
+    def contact_requested(self, contact_form_data):
+        """
+        Whether an emergency contact belongs to a checkout with the given contact
+        form data.
+        """
+        return self.contact_availability == "always" or contact_form_data.get(
+            "has_onpremise_contact", False
+        )
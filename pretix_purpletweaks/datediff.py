@@ -21,28 +21,31 @@ class DateDiffWrapper:
         self.data = data
 
     def datetime(self, order) -> datetime.datetime:
-        from pretix.base.models import SubEvent
-
         event = order.event
         tz = pytz.timezone(event.settings.timezone)
         if self.data.mode == "after_order":
-            new_date = order.datetime.astimezone(tz) + datetime.timedelta(
-                days=self.data.days
-            )
-        else:  # before event
-            if order.event.has_subevents:
-                event = (
-                    event.subevents.filter(
-                        id__in=order.positions.values_list("subevent", flat=True)
-                    )
-                    .order_by("date_from")
-                    .last()
+            return self.resolve(order.datetime, None, tz)
+        if order.event.has_subevents:
+            event = (
+                event.subevents.filter(
+                    id__in=order.positions.values_list("subevent", flat=True)
                 )
-            new_date = event.date_from.astimezone(tz) - datetime.timedelta(
+                .order_by("date_from")
+                .last()
+            )
+        return self.resolve(order.datetime, event.date_from, tz)
+
+    def resolve(self, order_datetime, event_date_from, tz):
+        """
+        Like ``datetime``, but with the dates of the order and of the event, or its
+        last subevent in the order, already known. ``event_date_from`` is only
+        needed for dates before the event.
+        """
+        if self.data.mode == "after_order":
+            return order_datetime.astimezone(tz) + datetime.timedelta(
                 days=self.data.days
             )
-
-        return new_date
+        return event_date_from.astimezone(tz) - datetime.timedelta(days=self.data.days)
 
     def to_string(self) -> str:
         return "DATEDIFF/{}/{}/".format(self.data.days, self.data.mode)
@@ -1,15 +1,31 @@
-from collections import OrderedDict
-from datetime import timezone
-
+import billiard
 import bleach
 import dateutil.parser
+import hashlib
+import itertools
+import json
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import unicodedata
+import uuid
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
 from django.db.models import (
     Case,
+    Count,
     Exists,
     F,
     Max,
     OuterRef,
+    Prefetch,
     Q,
     Subquery,
     Value,
@@ -17,24 +33,24 @@ from django.db.models import (
 )
 from django.db.models.functions import Coalesce, NullIf
 from django.urls import reverse
+from django.utils import timezone as django_timezone, translation
 from django.utils.formats import date_format
+from django.utils.functional import cached_property
 from django.utils.timezone import is_aware, make_aware, now
-from django.utils.translation import (
-    gettext as _,
-    gettext_lazy,
-    pgettext,
-    pgettext_lazy,
-)
-from reportlab.lib.units import mm
-from reportlab.platypus import Flowable, Paragraph, Spacer, Table, TableStyle
-
+from django.utils.translation import gettext as _, gettext_lazy, pgettext, pgettext_lazy
+from django_scopes import scope, scopes_disabled
+from io import BytesIO
 from pretix.base.exporter import BaseExporter, ListExporter
+from pretix.base.forms.widgets import SplitDateTimePickerWidget
 from pretix.base.models import (
     Checkin,
+    Event,
     InvoiceAddress,
     Order,
+    OrderPayment,
     OrderPosition,
     Question,
+    QuestionAnswer,
 )
 from pretix.base.settings import PERSON_NAME_SCHEMES
 from pretix.base.templatetags.money import money_filter
@@ -47,14 +63,322 @@ from pretix.helpers.filenames import safe_for_filename
 from pretix.helpers.iter import chunked_iterable
 from pretix.helpers.templatetags.jsonfield import JSONExtract
 from pretix.plugins.checkinlists.exporters import (
-    PDFCheckinList,
     CBFlowable,
+    CheckInListMixin,
+    PDFCheckinList,
     TableTextRotate,
 )
-from pretix.plugins.reports.exporters import ReportlabExportMixin
+from pretix.plugins.reports.exporters import NumberedCanvas, ReportlabExportMixin
+from pypdf import PdfReader, PdfWriter
+from reportlab import rl_config
+from reportlab.lib.units import mm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Flowable, Paragraph, Spacer, Table, TableStyle
+from zipfile import ZipFile
+
+from . import __version__
+from .checkoutflow import get_order_contact
+
+
+class ChunkedStory(list):
+    """
+    A story that is only filled from ``source`` once reportlab has consumed the
+    flowables before, so that only a single chunk of the document is held in
+    memory at any time.
+    """
+
+    def __init__(self, story, source):
+        super().__init__(story)
+        self.source = iter(source)
+
+    def __len__(self):
+        if not super().__len__():
+            self.extend(itertools.islice(self.source, 1))
+        return super().__len__()
+
+
+class FormFlowableMixin:
+    """
+    Draws a flowable as a form XObject. Each distinct form is stored in the PDF only
+    once and then referenced from every page it appears on.
+    """
+
+    def get_form(self, fontname, fontsize):
+        """
+        Returns the name and the bounding box of the form.
+        """
+        raise NotImplementedError()  # NOQA
+
+    def draw(self):
+        canvas = self.canv
+        font = (canvas._fontname, canvas._fontsize)
+        name, bbox = self.get_form(*font)
+        if not canvas.hasForm(name):
+            canvas.beginForm(name, *bbox)
+            # Forms start with a fresh graphics state
+            canvas.setFont(*font)
+            super().draw()
+            canvas.endForm()
+        canvas.doForm(name)
+
+
+class SharedCBFlowable(FormFlowableMixin, CBFlowable):
+    def get_form(self, fontname, fontsize):
+        return "purple_cb_{:d}".format(self.checked), (0, -6 * mm, 6 * mm, 1 * mm)
+
+
+class SharedTableTextRotate(FormFlowableMixin, TableTextRotate):
+    def get_form(self, fontname, fontsize):
+        width = stringWidth(self.text, fontname, fontsize)
+        key = json.dumps([self.text, fontname, fontsize])
+        return (
+            "purple_rotate_{}".format(hashlib.md5(key.encode()).hexdigest()),
+            (-2 * fontsize, -fontsize, fontsize, width + fontsize),
+        )
+
+
+@contextmanager
+def binary_pdf_streams():
+    """
+    reportlab encodes compressed streams as ASCII85 by default, which makes them a
+    quarter larger. The switch is global, so it is only flipped while we build.
+    """
+    use_a85 = rl_config.useA85
+    rl_config.useA85 = 0
+    try:
+        yield
+    finally:
+        rl_config.useA85 = use_a85
+
+
+class CellParagraph(Paragraph):
+    """
+    Tables wrap their cells at the same width to compute the row heights, again
+    on every split and once more to draw them. Only the first wrap breaks lines.
+    """
+
+    def wrap(self, availWidth, availHeight):
+        if getattr(self, "_wrapped_width", None) != availWidth:
+            self._wrapped = super().wrap(availWidth, availHeight)
+            self._wrapped_width = availWidth
+        return self._wrapped
+
+
+class ParagraphFitter:
+    """
+    Builds paragraphs that are cut off with an ellipsis so they are not higher than
+    ``max_height``. The longest fitting prefix is found by a binary search and all
+    measured heights are remembered, so repeated texts are only laid out once.
+    """
+
+    ellipsis = "..."
+    max_cached_heights = 10000
+
+    def __init__(self, style, max_height):
+        self.style = style
+        self.max_height = max_height
+        self._heights = {}
 
+    def height(self, text, width):
+        key = (text, width)
+        if key not in self._heights:
+            if len(self._heights) >= self.max_cached_heights:
+                self._heights.clear()
+            self._heights[key] = Paragraph(text, self.style).wrap(width, 5000)[1]
+        return self._heights[key]
 
-class PortraitPDFCheckinList(PDFCheckinList):
+    def cut(self, text, length):
+        text = text[:length]
+        # Never cut into markup or entities, reportlab would fail to parse them
+        if text.rfind("<") > text.rfind(">"):
+            text = text[: text.rfind("<")]
+        if text.rfind("&") > text.rfind(";"):
+            text = text[: text.rfind("&")]
+        return text + self.ellipsis
+
+    def fit_text(self, text, width):
+        if self.height(text, width) > self.max_height:
+            fits, too_long = 0, len(text)
+            while too_long - fits > 1:
+                length = (fits + too_long) // 2
+                if self.height(self.cut(text, length), width) <= self.max_height:
+                    fits = length
+                else:
+                    too_long = length
+            text = self.cut(text, fits)
+        return text
+
+    def fit(self, text, width):
+        return Paragraph(self.fit_text(text, width), self.style)
+
+
+class ParallelRenderMixin:
+    @cached_property
+    def processes(self):
+        return settings.CONFIG_FILE.getint(
+            "purpletweaks", "export_processes", fallback=1
+        )
+
+    def _map_parallel(self, func, args):
+        """
+        Lazily maps ``func`` over ``args`` in a pool of worker processes, keeping
+        the order of the results.
+        """
+        if self.processes < 2 or len(args) < 2:
+            yield from map(func, args)
+            return
+        ctx = billiard.get_context("fork")
+        with ctx.Pool(
+            min(self.processes, len(args)), initializer=_detach_connections
+        ) as pool:
+            yield from pool.imap(func, args)
+
+
+class PortraitCheckinListMixin:
+    """
+    Shared by all exports with the columns of the portrait check-in list, so that
+    every format shows the same rows with the same texts.
+    """
+
+    def _get_queryset(self, cl, form_data, prefetch=True):
+        """
+        Extends the check-in list queryset so that rendering a row never hits the
+        database: answers are only fetched for the selected questions and only the
+        first payment of every order is loaded.
+        """
+        qs = super()._get_queryset(cl, form_data, prefetch=False)
+        if not prefetch:
+            return qs
+
+        answers = QuestionAnswer.objects.filter(
+            question__in=form_data.get("questions") or []
+        ).select_related("question")
+        first_payment = (
+            OrderPayment.objects.filter(order_id=OuterRef("order_id"))
+            .order_by("local_id")
+            .values("pk")[:1]
+        )
+        return qs.select_related("subevent").prefetch_related(
+            Prefetch("answers", queryset=answers),
+            Prefetch("addon_to__answers", queryset=answers),
+            Prefetch(
+                "order__payments",
+                queryset=OrderPayment.objects.filter(pk=Subquery(first_payment)),
+                to_attr="purple_first_payment",
+            ),
+        )
+
+    @cached_property
+    def _memo(self):
+        return defaultdict(dict)
+
+    def _memoized(self, kind, key, compute):
+        """
+        Values that repeat across rows, e.g. labels of products or dates, are only
+        computed once per export.
+        """
+        memo = self._memo[kind]
+        if key not in memo:
+            memo[key] = compute()
+        return memo[key]
+
+    @cached_property
+    def payment_provider_names(self):
+        return {
+            identifier: provider.public_name if identifier != "free" else ""
+            for identifier, provider in self.event.get_payment_providers(
+                cached=True
+            ).items()
+        }
+
+    def _get_payment_provider_name(self, op):
+        payment = next(iter(op.order.purple_first_payment), None)
+        if not payment:
+            return ""
+        return self.payment_provider_names.get(payment.provider, "")
+
+    def _get_name(self, op):
+        # Name scheme fallbacks walk up to the event, save a query per row
+        op.order.event = self.event
+        if op.addon_to:
+            op.addon_to.order = op.order
+        try:
+            ian = op.order.invoice_address.name
+            iac = op.order.invoice_address.company
+        except:
+            ian = ""
+            iac = ""
+
+        name = (
+            op.attendee_name
+            or (op.addon_to.attendee_name if op.addon_to else "")
+            or ian
+        )
+        return name, iac
+
+    def _get_item_label(self, op, payment_provider_name):
+        product = str(op.item) + (
+            " – " + str(op.variation.value) if op.variation else ""
+        )
+        if payment_provider_name:
+            return "{} ({}, {})".format(
+                product,
+                money_filter(op.price, self.event.currency),
+                payment_provider_name,
+            )
+        return "{} ({})".format(product, money_filter(op.price, self.event.currency))
+
+    def _get_subevent_label(self, op):
+        return "{} ({})".format(
+            op.subevent.name,
+            date_format(
+                op.subevent.date_from.astimezone(self.event.timezone),
+                "SHORT_DATETIME_FORMAT",
+            ),
+        )
+
+    def _get_product_lines(self, op, cl):
+        """
+        Returns the product label, the date and the seat of a position. The date
+        is only set for lists of all dates of an event series.
+        """
+        payment_provider_name = self._get_payment_provider_name(op)
+        product = self._memoized(
+            "item_label",
+            (op.item_id, op.variation_id, op.price, payment_provider_name),
+            lambda: self._get_item_label(op, payment_provider_name),
+        )
+        subevent = ""
+        if self.event.has_subevents and not cl.subevent:
+            subevent = self._memoized(
+                "subevent_label", op.subevent_id, lambda: self._get_subevent_label(op)
+            )
+        return product, subevent, str(op.seat) if op.seat else ""
+
+    def _get_answers(self, op):
+        acache = {}
+        if op.addon_to:
+            for a in op.addon_to.answers.all():
+                # We do not want to localize Date, Time and Datetime question answers, as those can lead
+                # to difficulties parsing the data (for example 2019-02-01 may become Février, 2019 01 in French).
+                if a.question.type in Question.UNLOCALIZED_TYPES:
+                    acache[a.question_id] = a.answer
+                else:
+                    acache[a.question_id] = str(a)
+        for a in op.answers.all():
+            # We do not want to localize Date, Time and Datetime question answers, as those can lead
+            # to difficulties parsing the data (for example 2019-02-01 may become Février, 2019 01 in French).
+            if a.question.type in Question.UNLOCALIZED_TYPES:
+                acache[a.question_id] = a.answer
+            else:
+                acache[a.question_id] = str(a)
+        return acache
+
+
+class PortraitPDFCheckinList(
+    ParallelRenderMixin, PortraitCheckinListMixin, PDFCheckinList
+):
     name = "purble overview"
     identifier = "purple_checkinlistpdf"
     verbose_name = gettext_lazy("Check-in list (Portrait PDF)")
@@ -64,6 +388,19 @@ class PortraitPDFCheckinList(PDFCheckinList):
         "event without digital methods."
     )
     numbered_canvas = True
+    chunk_size = 250
+    min_segment_size = 1000
+    segment = None
+    # Cached lists are served unchanged, so their footer keeps the time they
+    # were first created at
+    cache_timeout = 3600
+    row_cache_timeout = 7 * 24 * 3600
+
+    @property
+    def repeatable_read(self):
+        # The workers of a parallel export cannot see the transaction of the
+        # parent, so its rows would not be consistent with theirs anyway
+        return self.processes < 2
 
     @property
     def pagesize(self):
@@ -71,6 +408,225 @@ class PortraitPDFCheckinList(PDFCheckinList):
 
         return pagesizes.portrait(pagesizes.A4)
 
+    def canvas_class(self, doc):
+        if self.segment is not None:
+            # Page numbers are added after all segments have been merged
+            return Canvas
+        return super().canvas_class(doc)
+
+    def create(self, form_data):
+        if self.segment is not None:
+            return self._build(form_data)
+
+        started = now()
+        cl = self.event.checkin_lists.get(pk=form_data["list"])
+        form_data = dict(
+            form_data, changed_since=self._get_changed_since(cl, form_data)
+        )
+
+        cache_key = self._get_cache_key(cl, form_data)
+        data = self.event.cache.get(cache_key)
+        if data is None:
+            segments = self._get_segments(form_data) if self.processes > 1 else []
+            if len(segments) > 1:
+                data = self._create_parallel(form_data, segments)
+            else:
+                data = self._build(form_data)
+            self.event.cache.set(cache_key, data, self.cache_timeout)
+            if form_data.get("changed_only"):
+                # Exports run in a read-only transaction, remember the time of
+                # this list's incremental export once it is over
+                transaction.on_commit(
+                    lambda: self.event.settings.set(
+                        self._get_last_export_key(cl), started
+                    )
+                )
+        return data
+
+    def _build(self, form_data):
+        with binary_pdf_streams():
+            return super().create(form_data)
+
+    @staticmethod
+    def _get_last_export_key(cl):
+        return "purple_checkinlistpdf_last_export_{}".format(cl.pk)
+
+    def _get_changed_since(self, cl, form_data):
+        if not form_data.get("changed_only"):
+            return None
+        since = form_data.get("changed_since")
+        if isinstance(since, str):
+            since = dateutil.parser.parse(since)
+        if since and not is_aware(since):
+            since = make_aware(since, self.timezone)
+        return since or self.event.settings.get(
+            self._get_last_export_key(cl), as_type=datetime
+        )
+
+    @staticmethod
+    def invalidate_cache(event, rows=False):
+        """
+        Drops the cached lists of the event. With ``rows``, the cached cells of
+        its rows are dropped as well, which is needed whenever data is changed
+        without touching the orders, e.g. by the data shredders.
+        """
+        event.cache.set(
+            "purple_checkinlistpdf_generation", uuid.uuid4().hex, timeout=None
+        )
+        if rows:
+            event.cache.set(
+                "purple_checkinlistpdf_row_generation", uuid.uuid4().hex, timeout=None
+            )
+
+    def _get_generation(self, key):
+        return self.event.cache.get_or_set(key, lambda: uuid.uuid4().hex, None)
+
+    def _get_fingerprint(self, cl):
+        """
+        Cheap summary of all data shown on the list. pretix touches the order
+        whenever one of its positions, answers, payments or check-ins is saved.
+        """
+        orders = Order.objects.filter(event=OuterRef("pk")).order_by().values("event")
+        checkins = Checkin.objects.filter(list=cl).order_by().values("list")
+        return Event.objects.filter(pk=self.event.pk).values(
+            orders_modified=Subquery(
+                orders.annotate(m=Max("last_modified")).values("m")
+            ),
+            orders_count=Subquery(orders.annotate(c=Count("pk")).values("c")),
+            checkins_max=Subquery(checkins.annotate(m=Max("pk")).values("m")),
+            checkins_count=Subquery(checkins.annotate(c=Count("pk")).values("c")),
+        )[0]
+
+    def _get_cache_key(self, cl, form_data):
+        generation = self._get_generation("purple_checkinlistpdf_generation")
+        digest = hashlib.sha256(
+            json.dumps(
+                {
+                    "list": cl.pk,
+                    "form_data": form_data,
+                    "fingerprint": self._get_fingerprint(cl),
+                    "generation": generation,
+                    "language": translation.get_language(),
+                    "timezone": django_timezone.get_current_timezone_name(),
+                },
+                sort_keys=True,
+                default=str,
+            ).encode()
+        ).hexdigest()
+        return "purple_checkinlistpdf_{}".format(digest)
+
+    def _get_segments(self, form_data):
+        """
+        Splits the list into segments that can be rendered independently: one per
+        date of an event series, or ranges of rows of the same size otherwise.
+        """
+        cl = self.event.checkin_lists.get(pk=form_data["list"])
+        positions = list(
+            self._get_queryset(cl, form_data, prefetch=False).values_list(
+                "pk", "subevent_id"
+            )
+        )
+        if len(positions) < 2 * self.min_segment_size:
+            return []
+
+        if self.event.has_subevents and not cl.subevent:
+            groups = [
+                [pk for pk, subevent_id in group]
+                for _subevent_id, group in itertools.groupby(
+                    positions, key=lambda p: p[1]
+                )
+            ]
+        else:
+            groups = [[pk for pk, subevent_id in positions]]
+
+        size = max(self.min_segment_size, math.ceil(len(positions) / self.processes))
+        return [
+            {"index": index, "positions": list(pks)}
+            for index, pks in enumerate(
+                pks for group in groups for pks in chunked_iterable(group, size)
+            )
+        ]
+
+    def _create_parallel(self, form_data, segments):
+        pdfs = self._map_parallel(
+            _render_segment,
+            [
+                (
+                    self.event.pk,
+                    form_data,
+                    segment,
+                    translation.get_language(),
+                    django_timezone.get_current_timezone_name(),
+                )
+                for segment in segments
+            ],
+        )
+
+        writer = PdfWriter()
+        for pdf in pdfs:
+            writer.append(PdfReader(BytesIO(pdf)))
+
+        self.register_fonts()
+        numbers = BytesIO()
+        canvas = NumberedCanvas(
+            numbers,
+            pagesize=self.pagesize,
+            font_regular="OpenSans",
+            x=15 * mm,
+            y=10 * mm,
+        )
+        for _page in writer.pages:
+            canvas.showPage()
+        canvas.save()
+        for page, overlay in zip(writer.pages, PdfReader(numbers).pages):
+            page.merge_page(overlay)
+            # Merging leaves the page content uncompressed
+            page.compress_content_streams()
+        # ...and the replaced content streams behind
+        writer.compress_identical_objects()
+
+        output = BytesIO()
+        writer.write(output)
+        return output.getvalue()
+
+    def _get_queryset(self, cl, form_data, prefetch=True):
+        qs = super()._get_queryset(cl, form_data, prefetch)
+        if self.segment is not None:
+            qs = qs.filter(pk__in=self.segment["positions"])
+        if form_data.get("changed_since"):
+            # pretix touches the order whenever one of its positions, answers,
+            # payments or check-ins is saved or deleted
+            qs = qs.filter(order__last_modified__gte=form_data["changed_since"])
+        return qs
+
+    @property
+    def export_form_fields(self):
+        f = super().export_form_fields
+        f["chunked"] = forms.BooleanField(
+            label=_("Render in chunks"),
+            help_text=_(
+                "Keeps memory usage low for very large lists. The table header is "
+                "repeated every {} rows."
+            ).format(self.chunk_size),
+            required=False,
+        )
+        f["changed_only"] = forms.BooleanField(
+            label=_("Only changed tickets"),
+            help_text=_(
+                "Only include tickets whose order, payment, answers or check-in "
+                "changed since the time below, or since the previous export of "
+                "this list."
+            ),
+            required=False,
+        )
+        f["changed_since"] = forms.SplitDateTimeField(
+            label=_("Changed since"),
+            required=False,
+            widget=SplitDateTimePickerWidget(),
+            help_text=_("Defaults to the time of the previous export of this list."),
+        )
+        return f
+
     def get_story(self, doc, form_data):
         cl = self.event.checkin_lists.get(pk=form_data["list"])
 
@@ -115,136 +671,584 @@ class PortraitPDFCheckinList(PDFCheckinList):
                 ),
             ]
 
+        if form_data.get("changed_since"):
+            story += [
+                Spacer(1, 3 * mm),
+                Paragraph(
+                    _("Changes since {datetime}").format(
+                        datetime=date_format(
+                            form_data["changed_since"].astimezone(self.timezone),
+                            "SHORT_DATETIME_FORMAT",
+                        )
+                    ),
+                    self.get_style(),
+                ),
+            ]
+
         story += [Spacer(1, 5 * mm)]
+        if self.segment is not None and self.segment["index"] > 0:
+            # Only the first segment of a parallel export starts with the headline
+            story = []
 
-        tdata = [
-            [
-                "",
-                "",
-                # Translators: maximum 5 characters
-                TableTextRotate(pgettext("tablehead", "paid")),
-                _("Order"),
-                _("Name"),
-                _("Product") + " / " + _("Price"),
-            ],
+        header = self._get_header_row(questions, colwidths)
+        qs = self._get_queryset(cl, form_data)
+
+        def get_table(ops):
+            tdata = [header]
+            unpaid_rows = []
+            blocked_rows = []
+            for batch in chunked_iterable(ops, self.chunk_size):
+                cells = self._get_row_cells(batch, questions, colwidths)
+                for op in batch:
+                    if op.order.status != Order.STATUS_PAID:
+                        unpaid_rows.append(len(tdata))
+                    if op.blocked:
+                        blocked_rows.append(len(tdata))
+                    tdata.append(self._get_row(op, cl, cells[op.pk]))
+            table = Table(tdata, colWidths=colwidths, repeatRows=1)
+            table.setStyle(
+                TableStyle(
+                    tstyledata
+                    + self._get_highlight_style(unpaid_rows, 2)
+                    + self._get_highlight_style(blocked_rows, 1)
+                )
+            )
+            return table
+
+        if not form_data.get("chunked"):
+            story.append(get_table(qs))
+            return story
+
+        return ChunkedStory(
+            story,
+            (
+                get_table(ops)
+                for ops in chunked_iterable(
+                    qs.iterator(chunk_size=self.chunk_size), self.chunk_size
+                )
+            ),
+        )
+
+    @cached_property
+    def cleaner(self):
+        return bleach.Cleaner(tags=["br"])
+
+    @cached_property
+    def row_style(self):
+        return self.get_style()
+
+    @cached_property
+    def answer_fitter(self):
+        return ParagraphFitter(self.row_style, 50 * mm)
+
+    @cached_property
+    def blocked_label(self):
+        return '<font face="OpenSansBd">[' + _("Blocked") + "]</font> "
+
+    def _clean(self, text):
+        return self.cleaner.clean(str(text)).strip().replace("<br>", "<br/>")
+
+    def _get_header_row(self, questions, colwidths):
+        header = [
+            "",
+            "",
+            # Translators: maximum 5 characters
+            SharedTableTextRotate(pgettext("tablehead", "paid")),
+            _("Order"),
+            _("Name"),
+            _("Product") + " / " + _("Price"),
         ]
 
         headrowstyle = self.get_style()
         headrowstyle.fontName = "OpenSansBd"
+        fitter = ParagraphFitter(headrowstyle, 30 * mm)
         for q in questions:
-            txt = str(q.question)
-            p = Paragraph(txt, headrowstyle)
-            while p.wrap(colwidths[len(tdata[0])], 5000)[1] > 30 * mm:
-                txt = txt[: len(txt) - 50] + "..."
-                p = Paragraph(txt, headrowstyle)
-            tdata[0].append(p)
+            header.append(fitter.fit(str(q.question), colwidths[len(header)]))
+        return header
 
-        qs = self._get_queryset(cl, form_data)
+    def _get_row_cells(self, ops, questions, colwidths):
+        """
+        Returns the name and answer cells of the given positions, reusing those of
+        previous exports. pretix touches the order whenever a position, answer or
+        invoice address is saved, so its modification time versions the cells.
+        """
+        context = hashlib.sha256(
+            json.dumps(
+                [
+                    __version__,
+                    self._get_generation("purple_checkinlistpdf_row_generation"),
+                    [q.pk for q in questions],
+                    colwidths,
+                    translation.get_language(),
+                    self.event.settings.name_scheme,
+                ]
+            ).encode()
+        ).hexdigest()[:16]
+        keys = {
+            op.pk: "purple_checkinlistpdf_row_{}_{}_{}".format(
+                op.pk, op.order.last_modified.timestamp(), context
+            )
+            for op in ops
+        }
+        # The event cache looks up its namespace once per key, which adds up for
+        # thousands of rows. Position ids are unique, so no namespace is needed.
+        cells = cache.get_many(list(keys.values()))
+        missing = {}
+        for op in ops:
+            if keys[op.pk] not in cells:
+                cells[keys[op.pk]] = missing[keys[op.pk]] = self._get_cells(
+                    op, questions, colwidths
+                )
+        if missing:
+            cache.set_many(missing, self.row_cache_timeout)
+        return {pk: cells[key] for pk, key in keys.items()}
 
-        for op in qs:
-            try:
-                ian = op.order.invoice_address.name
-                iac = op.order.invoice_address.company
-            except:
-                ian = ""
-                iac = ""
-
-            name = (
-                op.attendee_name
-                or (op.addon_to.attendee_name if op.addon_to else "")
-                or ian
+    def _get_cells(self, op, questions, colwidths):
+        name, company = self._get_name(op)
+        name = self._clean(name)
+        if company:
+            name += "<br/>" + self._clean(company)
+        acache = self._get_answers(op)
+        return name, [
+            # Answers start in the seventh column
+            self.answer_fitter.fit_text(
+                self._clean(acache.get(q.pk, "")), colwidths[6 + i]
+            )
+            for i, q in enumerate(questions)
+        ]
+
+    def _get_row(self, op, cl, cells):
+        name, answers = cells
+        if op.blocked:
+            name = self.blocked_label + name
+
+        payment_provider_name = self._get_payment_provider_name(op)
+        item = self._memoized(
+            "item_cell",
+            (op.item_id, op.variation_id, op.price, payment_provider_name),
+            lambda: self._clean(self._get_item_label(op, payment_provider_name)),
+        )
+        if self.event.has_subevents and not cl.subevent:
+            item += "<br/>" + self._memoized(
+                "subevent_cell",
+                op.subevent_id,
+                lambda: self._clean(self._get_subevent_label(op)),
             )
-            if iac:
-                name += "<br/>" + iac
-
-            payment = op.order.payments.first()
-            if not payment:
-                payment_provider_name = ""
-            elif payment.payment_provider.identifier == "free":
-                payment_provider_name = ""
+        if op.seat:
+            item += "<br/>" + self._clean(str(op.seat))
+        row = [
+            "!!" if op.require_checkin_attention else "",
+            SharedCBFlowable(bool(op.last_checked_in)) if not op.blocked else "—",
+            "✘" if op.order.status != Order.STATUS_PAID else "✔",
+            op.order.code,
+            CellParagraph(name, self.row_style),
+            CellParagraph(item, self.row_style),
+        ] + [CellParagraph(answer, self.row_style) for answer in answers]
+        return row
+
+    @staticmethod
+    def _get_highlight_style(rows, column):
+        """
+        Highlights the cells of ``column`` in the given ascending table rows, with
+        one set of commands per run of consecutive rows.
+        """
+        tstyledata = []
+        for _offset, run in itertools.groupby(
+            enumerate(rows), key=lambda r: r[1] - r[0]
+        ):
+            run = list(run)
+            start, end = (column, run[0][1]), (column, run[-1][1])
+            tstyledata += [
+                ("BACKGROUND", start, end, "#990000"),
+                ("TEXTCOLOR", start, end, "#ffffff"),
+                ("ALIGN", start, end, "CENTER"),
+            ]
+        return tstyledata
+
+
+class PortraitCheckinList(PortraitCheckinListMixin, CheckInListMixin, ListExporter):
+    name = "purple overview"
+    identifier = "purple_checkinlist"
+    verbose_name = gettext_lazy("Check-in list (Portrait columns)")
+    category = pgettext_lazy("export_category", "Check-in")
+    description = gettext_lazy(
+        "Download a spreadsheet with the columns of the portrait PDF check-in list. "
+        "Much faster than the PDF for large lists."
+    )
+    repeatable_read = False
+    chunk_size = 1000
+
+    @property
+    def additional_form_fields(self):
+        f = self._fields
+        del f["secrets"]
+        return f
+
+    def iterate_list(self, form_data):
+        self.cl = cl = self.event.checkin_lists.get(pk=form_data["list"])
+
+        questions = list(
+            Question.objects.filter(event=self.event, id__in=form_data["questions"])
+        )
+        qs = self._get_queryset(cl, form_data)
+
+        yield [
+            _("Requires special attention"),
+            _("Checked in"),
+            _("Paid"),
+            _("Order code"),
+            _("Name"),
+            _("Product") + " / " + _("Price"),
+        ] + [str(q.question) for q in questions]
+        yield self.ProgressSetTotal(total=qs.count())
+
+        yes, no, blocked = _("Yes"), _("No"), _("Blocked")
+        for op in qs.iterator(chunk_size=self.chunk_size):
+            name, company = self._get_name(op)
+            if company:
+                name += "\n" + company
+
+            product = self._get_product_lines(op, cl)
+            if op.blocked:
+                checked_in = blocked
             else:
-                payment_provider_name = (
-                    payment.payment_provider.public_name if payment else ""
+                checked_in = yes if op.last_checked_in else no
+            acache = self._get_answers(op)
+            yield [
+                "!!" if op.require_checkin_attention else "",
+                checked_in,
+                yes if op.order.status == Order.STATUS_PAID else no,
+                op.order.code,
+                name,
+                "\n".join(line for line in product if line),
+            ] + [acache.get(q.pk, "") for q in questions]
+
+    def get_filename(self):
+        return "{}_checkin_portrait_{}".format(
+            self.event.slug, safe_for_filename(self.cl.name)
+        )
+
+
+class OfflineCheckinBundle(PortraitCheckinListMixin, CheckInListMixin, BaseExporter):
+    identifier = "purple_checkinlist_sqlite"
+    verbose_name = gettext_lazy("Check-in list (Offline SQLite database)")
+    category = pgettext_lazy("export_category", "Check-in")
+    description = gettext_lazy(
+        "Download a SQLite database with the tickets, answers and emergency contacts "
+        "of a check-in list that can be searched quickly without internet access."
+    )
+    repeatable_read = False
+    chunk_size = 1000
+    schema = """
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE questions (id INTEGER PRIMARY KEY, question TEXT);
+        CREATE TABLE positions (
+            id INTEGER PRIMARY KEY,
+            order_code TEXT NOT NULL,
+            name TEXT,
+            name_normalized TEXT COLLATE NOCASE,
+            company TEXT,
+            product TEXT,
+            subevent TEXT,
+            seat TEXT,
+            paid INTEGER NOT NULL,
+            blocked INTEGER NOT NULL,
+            attention INTEGER NOT NULL,
+            checked_in INTEGER NOT NULL,
+            emergency_name TEXT,
+            emergency_telephone TEXT,
+            emergency_address TEXT
+        );
+        CREATE TABLE answers (
+            position_id INTEGER NOT NULL REFERENCES positions (id),
+            question_id INTEGER NOT NULL REFERENCES questions (id),
+            answer TEXT,
+            PRIMARY KEY (position_id, question_id)
+        ) WITHOUT ROWID;
+    """
+    # Created after all rows are inserted, which is a lot faster than keeping
+    # them up to date during the import
+    indexes = """
+        CREATE INDEX positions_order_code ON positions (order_code);
+        CREATE INDEX positions_name_normalized ON positions (name_normalized);
+        CREATE INDEX positions_seat ON positions (seat);
+    """
+
+    @property
+    def export_form_fields(self):
+        f = self._fields
+        del f["secrets"]
+        return f
+
+    @staticmethod
+    def normalize_name(name):
+        """
+        Lower case without accents and repeated whitespace, so that a prefix search
+        with ``name_normalized LIKE 'muller%'`` also finds "Müller" and can use the
+        index.
+        """
+        name = unicodedata.normalize("NFKD", name or "")
+        name = "".join(c for c in name if not unicodedata.combining(c))
+        return " ".join(name.casefold().split())
+
+    def _get_queryset(self, cl, form_data):
+        return (
+            super()
+            ._get_queryset(cl, form_data)
+            .select_related("order__purple_onpremise_contact")
+        )
+
+    def _get_emergency_contact(self, order):
+        data = get_order_contact(order)
+        if not data:
+            return None, None, None
+        return (
+            data["name"][1],
+            data["telephone"][1],
+            data["street"][1] + "\n" + data["city"][1],
+        )
+
+    def render(self, form_data, output_file=None):
+        self.cl = cl = self.event.checkin_lists.get(pk=form_data["list"])
+        questions = list(
+            Question.objects.filter(event=self.event, id__in=form_data["questions"])
+        )
+        qs = self._get_queryset(cl, form_data)
+        total = qs.count()
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "checkin.sqlite3")
+            db = sqlite3.connect(path)
+            try:
+                # A half-written file is thrown away anyway, skip the journal
+                db.execute("PRAGMA journal_mode = OFF")
+                db.execute("PRAGMA synchronous = OFF")
+                db.executescript(self.schema)
+                db.executemany(
+                    "INSERT INTO meta VALUES (?, ?)",
+                    [
+                        ("event", str(self.event.name)),
+                        ("list", cl.name),
+                        ("created", now().isoformat()),
+                    ],
                 )
-            if payment_provider_name:
-                item = "{} ({}, {})".format(
-                    str(op.item)
-                    + (" – " + str(op.variation.value) if op.variation else ""),
-                    money_filter(op.price, self.event.currency),
-                    payment_provider_name,
+                db.executemany(
+                    "INSERT INTO questions VALUES (?, ?)",
+                    [(q.pk, str(q.question)) for q in questions],
                 )
-            else:
-                item = "{} ({})".format(
-                    str(op.item)
-                    + (" – " + str(op.variation.value) if op.variation else ""),
-                    money_filter(op.price, self.event.currency),
+                done = 0
+                for ops in chunked_iterable(
+                    qs.iterator(chunk_size=self.chunk_size), self.chunk_size
+                ):
+                    self._write_positions(db, cl, questions, ops)
+                    done += len(ops)
+                    self.progress_callback(done / total * 100)
+                db.executescript(self.indexes)
+                db.commit()
+            finally:
+                db.close()
+
+            filename = "{}_checkin_{}.sqlite3".format(
+                self.event.slug, safe_for_filename(cl.name)
+            )
+            with open(path, "rb") as f:
+                if output_file:
+                    shutil.copyfileobj(f, output_file)
+                    return filename, "application/vnd.sqlite3", None
+                return filename, "application/vnd.sqlite3", f.read()
+
+    def _write_positions(self, db, cl, questions, ops):
+        positions = []
+        answers = []
+        for op in ops:
+            name, company = self._get_name(op)
+            product, subevent, seat = self._get_product_lines(op, cl)
+            positions.append(
+                (
+                    op.pk,
+                    op.order.code,
+                    name,
+                    self.normalize_name(name),
+                    company,
+                    product,
+                    subevent,
+                    seat,
+                    op.order.status == Order.STATUS_PAID,
+                    bool(op.blocked),
+                    bool(op.require_checkin_attention),
+                    bool(op.last_checked_in),
                 )
+                + self._get_emergency_contact(op.order)
+            )
+            acache = self._get_answers(op)
+            answers += [
+                (op.pk, q.pk, acache[q.pk]) for q in questions if q.pk in acache
+            ]
+        db.executemany(
+            "INSERT INTO positions VALUES ({})".format(", ".join("?" * 15)), positions
+        )
+        db.executemany("INSERT INTO answers VALUES (?, ?, ?)", answers)
+
+
+class PortraitPDFCheckinListCollection(ParallelRenderMixin, BaseExporter):
+    identifier = "purple_checkinlistpdf_collection"
+    verbose_name = gettext_lazy("Check-in lists (Portrait PDF, ZIP)")
+    category = pgettext_lazy("export_category", "Check-in")
+    description = gettext_lazy(
+        "Download a ZIP file with a portrait PDF of every check-in list of the "
+        "selected events."
+    )
+    repeatable_read = False
 
-            if self.event.has_subevents and not cl.subevent:
-                item += "<br/>{} ({})".format(
-                    op.subevent.name,
-                    date_format(
-                        op.subevent.date_from.astimezone(self.event.timezone),
-                        "SHORT_DATETIME_FORMAT",
+    @property
+    def export_form_fields(self):
+        questions = OrderedDict(
+            (identifier, str(question))
+            for identifier, question in Question.objects.filter(
+                event__in=self.events
+            ).values_list("identifier", "question")
+        )
+        return OrderedDict(
+            [
+                (
+                    "questions",
+                    forms.MultipleChoiceField(
+                        label=_("Include questions"),
+                        choices=list(questions.items()),
+                        widget=forms.CheckboxSelectMultiple(
+                            attrs={"class": "scrolling-multiple-choice"}
+                        ),
+                        help_text=_(
+                            "Questions are matched by their internal identifier in "
+                            "all events."
+                        ),
+                        required=False,
+                    ),
+                ),
+                (
+                    "sort",
+                    forms.ChoiceField(
+                        label=_("Sort by"),
+                        initial="name",
+                        choices=[
+                            ("name", _("Attendee name")),
+                            ("code", _("Order code")),
+                            ("order_datetime", _("Order date")),
+                        ],
+                        widget=forms.RadioSelect,
+                        required=False,
+                    ),
+                ),
+                (
+                    "attention_only",
+                    forms.BooleanField(
+                        label=_("Only tickets requiring special attention"),
+                        required=False,
+                    ),
+                ),
+                (
+                    "chunked",
+                    forms.BooleanField(
+                        label=_("Render in chunks"),
+                        help_text=_("Keeps memory usage low for very large lists."),
+                        required=False,
                     ),
-                )
-            if op.seat:
-                item += "<br/>" + str(op.seat)
-            name = bleach.clean(str(name), tags=["br"]).strip().replace("<br>", "<br/>")
-            if op.blocked:
-                name = '<font face="OpenSansBd">[' + _("Blocked") + "]</font> " + name
-            row = [
-                "!!" if op.require_checkin_attention else "",
-                CBFlowable(bool(op.last_checked_in)) if not op.blocked else "—",
-                "✘" if op.order.status != Order.STATUS_PAID else "✔",
-                op.order.code,
-                Paragraph(name, self.get_style()),
-                Paragraph(
-                    bleach.clean(str(item), tags=["br"])
-                    .strip()
-                    .replace("<br>", "<br/>"),
-                    self.get_style(),
                 ),
             ]
-            acache = {}
-            if op.addon_to:
-                for a in op.addon_to.answers.all():
-                    # We do not want to localize Date, Time and Datetime question answers, as those can lead
-                    # to difficulties parsing the data (for example 2019-02-01 may become Février, 2019 01 in French).
-                    if a.question.type in Question.UNLOCALIZED_TYPES:
-                        acache[a.question_id] = a.answer
-                    else:
-                        acache[a.question_id] = str(a)
-            for a in op.answers.all():
-                # We do not want to localize Date, Time and Datetime question answers, as those can lead
-                # to difficulties parsing the data (for example 2019-02-01 may become Février, 2019 01 in French).
-                if a.question.type in Question.UNLOCALIZED_TYPES:
-                    acache[a.question_id] = a.answer
-                else:
-                    acache[a.question_id] = str(a)
-            for q in questions:
-                txt = acache.get(q.pk, "")
-                txt = bleach.clean(txt, tags=["br"]).strip().replace("<br>", "<br/>")
-                p = Paragraph(txt, self.get_style())
-                while p.wrap(colwidths[len(row)], 5000)[1] > 50 * mm:
-                    txt = txt[: len(txt) - 50] + "..."
-                    p = Paragraph(txt, self.get_style())
-                row.append(p)
-            if op.order.status != Order.STATUS_PAID:
-                tstyledata += [
-                    ("BACKGROUND", (2, len(tdata)), (2, len(tdata)), "#990000"),
-                    ("TEXTCOLOR", (2, len(tdata)), (2, len(tdata)), "#ffffff"),
-                    ("ALIGN", (2, len(tdata)), (2, len(tdata)), "CENTER"),
-                ]
-            if op.blocked:
-                tstyledata += [
-                    ("BACKGROUND", (1, len(tdata)), (1, len(tdata)), "#990000"),
-                    ("TEXTCOLOR", (1, len(tdata)), (1, len(tdata)), "#ffffff"),
-                    ("ALIGN", (1, len(tdata)), (1, len(tdata)), "CENTER"),
-                ]
-            tdata.append(row)
+        )
 
-        table = Table(tdata, colWidths=colwidths, repeatRows=1)
-        table.setStyle(TableStyle(tstyledata))
-        story.append(table)
-        return story
+    def render(self, form_data, output_file=None):
+        events = [
+            e
+            for e in self.events.select_related("organizer")
+            if "pretix_purpletweaks" in e.get_plugins()
+        ]
+        # Look up the selected questions of all events at once
+        questions = defaultdict(list)
+        for event_id, pk in Question.objects.filter(
+            event__in=events, identifier__in=form_data.get("questions") or []
+        ).values_list("event_id", "pk"):
+            questions[event_id].append(pk)
+
+        args = [
+            (
+                event.pk,
+                {
+                    "questions": questions[event.pk],
+                    "sort": form_data.get("sort"),
+                    "attention_only": form_data.get("attention_only"),
+                    "chunked": form_data.get("chunked"),
+                },
+                translation.get_language(),
+                django_timezone.get_current_timezone_name(),
+            )
+            for event in events
+        ]
+
+        with tempfile.TemporaryDirectory() as d:
+            with ZipFile(output_file or os.path.join(d, "tmp.zip"), "w") as zipf:
+                for i, files in enumerate(
+                    self._map_parallel(_render_event_checkin_lists, args)
+                ):
+                    for filename, data in files:
+                        zipf.writestr(filename, data)
+                    self.progress_callback((i + 1) / len(args) * 100)
+
+            filename = "{}_checkinlists.zip".format(self.organizer.slug)
+            if output_file:
+                return filename, "application/zip", None
+            with open(os.path.join(d, "tmp.zip"), "rb") as zipf:
+                return filename, "application/zip", zipf.read()
+
+
+# Database connections inherited by the workers of a pool are kept referenced
+# and never closed, closing them would also end them for the parent process
+_inherited_connections = []
+
+
+def _detach_connections():
+    """
+    Runs in every worker of a pool, so that it opens database connections of its
+    own instead of using those of the parent, which might be in a transaction.
+    """
+    for conn in connections.all(initialized_only=True):
+        if conn.connection is not None:
+            _inherited_connections.append(conn.connection)
+        conn.connection = None
+        conn.in_atomic_block = False
+
+
+@contextmanager
+def _event_context(event_id, language, timezone_name):
+    with scopes_disabled():
+        event = Event.objects.select_related("organizer").get(pk=event_id)
+    with scope(organizer=event.organizer), translation.override(
+        language
+    ), django_timezone.override(timezone_name):
+        yield event
+
+
+def _render_segment(args):
+    event_id, form_data, segment, language, timezone_name = args
+    with _event_context(event_id, language, timezone_name) as event:
+        exporter = PortraitPDFCheckinList(event, event.organizer)
+        exporter.segment = segment
+        return exporter.create(form_data)
+
+
+def _render_event_checkin_lists(args):
+    event_id, form_data, language, timezone_name = args
+    with _event_context(event_id, language, timezone_name) as event:
+        # One exporter for all lists of the event shares settings and payment
+        # provider names, the lists of a collection are already rendered in parallel
+        exporter = PortraitPDFCheckinList(event, event.organizer)
+        exporter.processes = 1
+        return [
+            (
+                "{}/{}-{}.pdf".format(
+                    event.slug, cl.pk, safe_for_filename(str(cl.name))
+                ),
+                exporter.create(dict(form_data, list=cl.pk)),
+            )
+            for cl in event.checkin_lists.all()
+        ]
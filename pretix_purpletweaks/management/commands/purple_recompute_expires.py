@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django_scopes import scope, scopes_disabled
+from pretix.base.models import Event
+
+from pretix_purpletweaks.tasks import recompute_expires
+
+
+class Command(BaseCommand):
+    help = (
+        "Applies the expiration date rules of the purple payment providers to the "
+        "pending orders of an event again, e.g. after a rule or a date was changed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("organizer", help="Organizer slug")
+        parser.add_argument("event", help="Event slug")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many orders would change",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with scopes_disabled():
+            try:
+                event = Event.objects.select_related("organizer").get(
+                    organizer__slug=options["organizer"], slug=options["event"]
+                )
+            except Event.DoesNotExist:
+                raise CommandError("Event not found.")
+        with scope(organizer=event.organizer):
+            checked, changed = recompute_expires(
+                event, dry_run=options["dry_run"], batch_size=options["batch_size"]
+            )
+        self.stdout.write(
+            "{} of {} pending orders {}.".format(
+                changed,
+                checked,
+                "would change" if options["dry_run"] else "changed",
+            )
+        )
@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("pretixbase", "0245_discount_benefit_products"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OnPremiseContact",
+            fields=[
+                (
+                    "order",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="purple_onpremise_contact",
+                        serialize=False,
+                        to="pretixbase.order",
+                    ),
+                ),
+                ("name_parts", models.JSONField(default=dict)),
+                ("telephone", models.TextField()),
+                ("street", models.TextField()),
+                ("zipcode", models.TextField()),
+                ("city", models.TextField()),
+            ],
+        ),
+    ]
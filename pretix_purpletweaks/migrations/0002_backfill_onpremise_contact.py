@@ -0,0 +1,54 @@
+import json
+from django.db import migrations
+from django_scopes import scopes_disabled
+
+BATCH_SIZE = 1000
+FIELDS = ("name_parts", "telephone", "street", "zipcode", "city")
+
+
+def backfill_onpremise_contact(apps, schema_editor):
+    """
+    Copies the contact out of ``Order.meta_info``. The migration is not atomic,
+    every batch is committed on its own and already copied orders are skipped,
+    so an interrupted run can simply be started again.
+    """
+    Order = apps.get_model("pretixbase", "Order")
+    OnPremiseContact = apps.get_model("pretix_purpletweaks", "OnPremiseContact")
+    with scopes_disabled():
+        orders = (
+            Order.objects.filter(meta_info__contains='"onpremise_contact"')
+            .only("pk", "meta_info")
+            .order_by("pk")
+        )
+        batch = []
+        for order in orders.iterator(chunk_size=BATCH_SIZE):
+            try:
+                formdata = json.loads(order.meta_info).get("onpremise_contact")
+            except ValueError:
+                continue
+            if not formdata:
+                continue
+            batch.append(
+                OnPremiseContact(
+                    order_id=order.pk, **{f: formdata.get(f, "") for f in FIELDS}
+                )
+            )
+            if len(batch) >= BATCH_SIZE:
+                OnPremiseContact.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        OnPremiseContact.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ("pretix_purpletweaks", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_onpremise_contact, migrations.RunPython.noop, elidable=True
+        ),
+    ]
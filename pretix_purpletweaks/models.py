@@ -0,0 +1,43 @@
+from django.db import models
+from pretix.base.models import Order
+
+
+class OnPremiseContact(models.Model):
+    """
+    The emergency contact given in the checkout step of an order. It is stored
+    next to the order instead of only inside ``Order.meta_info``, so it can be
+    joined and prefetched without decoding the meta data of every order.
+    """
+
+    order = models.OneToOneField(
+        Order,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="purple_onpremise_contact",
+    )
+    name_parts = models.JSONField(default=dict)
+    telephone = models.TextField()
+    street = models.TextField()
+    zipcode = models.TextField()
+    city = models.TextField()
+
+    FIELDS = ("name_parts", "telephone", "street", "zipcode", "city")
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.order.touch()
+
+    def delete(self, *args, **kwargs):
+        # Deleting clears the primary key, which is the link to the order
+        order = self.order
+        result = super().delete(*args, **kwargs)
+        order.touch()
+        return result
+
+    @classmethod
+    def from_formdata(cls, order, formdata):
+        return cls(order=order, **{f: formdata.get(f, "") for f in cls.FIELDS})
+
+    @property
+    def formdata(self):
+        return {f: getattr(self, f) for f in self.FIELDS}
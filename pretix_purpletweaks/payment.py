@@ -1,14 +1,60 @@
 from collections import OrderedDict
 from django import forms
+from django.core.cache import cache
 from django.utils.translation import gettext_lazy as _
-from pretix.base.payment import ManualPayment, BasePaymentProvider
+from pretix.base.payment import BasePaymentProvider, ManualPayment
 from pretix.presale.views.cart import get_or_create_cart_id
 
-from .datediff import (
-    DateDiffField,
-    DateDiffWrapper,
-    date_diff_wrapper_from_string,
-)
+from .datediff import DateDiffField, date_diff_wrapper_from_string
+
+PAYMENT_MATRIX_KEY = "purple_payment_matrix_{}"
+
+
+def get_payment_matrix(event):
+    """
+    Returns for every purple payment provider of the event whether it is available
+    to individual and business customers and its expiration date rule, e.g.
+    ``{"purple_manual": {"individual": True, "business": False,
+    "overwrite_expires": "DATEDIFF/14/after_order/"}}``.
+
+    The matrix is kept in the cache until a provider setting or
+    ``invoice_address_asked`` changes, and on the event object for the rest of
+    the request.
+    """
+    matrix = getattr(event, "_purple_payment_matrix", None)
+    if matrix is not None:
+        return matrix
+    key = PAYMENT_MATRIX_KEY.format(event.pk)
+    matrix = cache.get(key)
+    if matrix is None:
+        # Without an invoice address, customer types can not be told apart
+        asked = event.settings.get("invoice_address_asked", as_type=bool)
+        matrix = {}
+        for provider_class in PURPLE_PAYMENT_PROVIDERS:
+            provider = provider_class(event)
+            matrix[provider.identifier] = {
+                "individual": not (
+                    asked
+                    and provider.settings.get(
+                        "_block_individual_customers", as_type=bool
+                    )
+                ),
+                "business": not (
+                    asked
+                    and provider.settings.get("_block_business_customers", as_type=bool)
+                ),
+                "overwrite_expires": provider.settings.get(
+                    "_overwrite_expires", as_type=str
+                )
+                or None,
+            }
+        cache.set(key, matrix, timeout=24 * 3600)
+    event._purple_payment_matrix = matrix
+    return matrix
+
+
+def invalidate_payment_matrix(*event_pks):
+    cache.delete_many([PAYMENT_MATRIX_KEY.format(pk) for pk in event_pks])
 
 
 class PurplePaymentMixin(object):
@@ -81,20 +127,16 @@ class PurplePaymentMixin(object):
         an individual or business customer. If the invoice address is not required or asked
         this check always returns True and thus doesn't block anything.
         """
-        if not self.event.settings.get("invoice_address_asked", as_type=bool):
+        availability = get_payment_matrix(self.event)[self.identifier]
+        if availability["individual"] and availability["business"]:
             return True
         if request and not hasattr(request, "_checkout_flow_invoice_address"):
             return True
-        block_indi = self.settings.get("_block_individual_customers", as_type=bool)
-        block_busi = self.settings.get("_block_business_customers", as_type=bool)
         if order:
             is_business = order.invoice_address.is_business
         else:
             is_business = request._checkout_flow_invoice_address.is_business
-        if is_business:
-            return not block_busi
-        else:
-            return not block_indi
+        return availability["business" if is_business else "individual"]
 
     def is_allowed(self, request, total=None) -> bool:
         """
@@ -120,9 +162,9 @@ class PurplePaymentMixin(object):
     def execute_payment(self, request, payment) -> str:
         super().execute_payment(request, payment)
         order = payment.order
-        expiration_date = self.settings.get(
-            "_overwrite_expires", as_type=DateDiffWrapper
-        )
+        expiration_date = get_payment_matrix(self.event)[self.identifier][
+            "overwrite_expires"
+        ]
         if expiration_date:
             expiration_date = date_diff_wrapper_from_string(expiration_date)
             order.expires = expiration_date.datetime(order).replace(
@@ -141,3 +183,10 @@ class PurpleManualPayment2(PurplePaymentMixin, ManualPayment):
 
 class PurpleManualPayment3(PurplePaymentMixin, ManualPayment):
     index = 2
+
+
+PURPLE_PAYMENT_PROVIDERS = [
+    PurpleManualPayment1,
+    PurpleManualPayment2,
+    PurpleManualPayment3,
+]
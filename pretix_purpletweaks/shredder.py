@@ -1,39 +1,108 @@
 import json
 from django.db import transaction
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
+from pretix.base.models import Order
 from pretix.base.shredder import BaseDataShredder
 
+from .checkoutflow import invalidate_order_contacts
+from .models import OnPremiseContact
+
 
 class OnPremiseContactShredder(BaseDataShredder):
     verbose_name = _("Emergency Contact")
     identifier = "onpremise_contact"
     description = _("This will remove customer on premise contact from orders.")
 
-    def _contact(self, order):
-        if not order.meta_info or not "onpremise_contact" in json.loads(
-            order.meta_info
-        ):
-            return {}
-        return json.loads(order.meta_info)["onpremise_contact"]
+    chunk_size = 1000
 
     def generate_files(self):
+        contacts = (
+            OnPremiseContact.objects.filter(order__event=self.event)
+            .order_by("order__code")
+            .values_list("order__code", *OnPremiseContact.FIELDS)
+        )
+        # pretix passes the content to ZipFile.writestr() as a whole, so the
+        # document cannot be streamed and its size grows with the event
         yield "emergency_contact.json", "application/json", json.dumps(
             {
-                order.code: self._contact(order)
-                for order in self.event.orders.all()
-                if self._contact(order)
+                code: dict(zip(OnPremiseContact.FIELDS, values))
+                for code, *values in contacts.iterator(chunk_size=self.chunk_size)
             },
             indent=4,
         )
 
-    @transaction.atomic
-    def shred_data(self):
-        for order in self.event.orders.all():
-            meta_info = json.loads(order.meta_info or {})
-            contact = meta_info.get("onpremise_contact", {})
-            for key in contact.keys():
-                contact[key] = "█"
-            meta_info["onpremise_contact"] = contact
-            if contact:
-                order.meta_info = json.dumps(meta_info)
-                order.save(update_fields=["meta_info"])
+    def shred_data(self, progress_callback=None):
+        """
+        Redacts the contacts in batches, each in a short transaction of its own,
+        so checkouts and payments of the event are not blocked for long. Batches
+        that were completed stay redacted if the task is interrupted, and running
+        it again continues with the remaining contacts.
+        """
+        # All fields of a contact are redacted at once, so the telephone number
+        # tells whether a previous run already got to it
+        contacts = (
+            OnPremiseContact.objects.filter(order__event=self.event)
+            .exclude(telephone="█")
+            .order_by("pk")
+        )
+        # The checkout step hands the contact over in the order's meta data
+        orders = (
+            self.event.orders.filter(meta_info__contains='"onpremise_contact"')
+            .only("pk", "meta_info")
+            .order_by("pk")
+        )
+        total = contacts.count() + orders.count()
+        done = 0
+
+        try:
+            last_pk = 0
+            while True:
+                with transaction.atomic():
+                    batch = list(
+                        contacts.filter(pk__gt=last_pk).values_list("pk", flat=True)[
+                            : self.chunk_size
+                        ]
+                    )
+                    if not batch:
+                        break
+                    OnPremiseContact.objects.filter(pk__in=batch).update(
+                        **{f: "█" for f in OnPremiseContact.FIELDS}
+                    )
+                    Order.objects.filter(pk__in=batch).update(last_modified=now())
+                last_pk = batch[-1]
+                done += len(batch)
+                if progress_callback:
+                    progress_callback(done * 100 // total)
+
+            last_pk = 0
+            while True:
+                with transaction.atomic():
+                    batch = list(
+                        orders.filter(pk__gt=last_pk).select_for_update(of=("self",))[
+                            : self.chunk_size
+                        ]
+                    )
+                    if not batch:
+                        break
+                    changed = [order for order in batch if self._shred_meta_info(order)]
+                    Order.objects.bulk_update(changed, ["meta_info", "last_modified"])
+                last_pk = batch[-1].pk
+                done += len(batch)
+                if progress_callback:
+                    progress_callback(done * 100 // total)
+        finally:
+            # The order info panels with the contacts are cached for the event
+            self.event.cache.clear()
+            invalidate_order_contacts()
+
+    @staticmethod
+    def _shred_meta_info(order):
+        meta_info = json.loads(order.meta_info)
+        contact = meta_info.get("onpremise_contact") or {}
+        if all(value == "█" for value in contact.values()):
+            return False
+        meta_info["onpremise_contact"] = {key: "█" for key in contact}
+        order.meta_info = json.dumps(meta_info)
+        order.last_modified = now()
+        return True
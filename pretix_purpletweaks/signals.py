@@ -1,32 +1,71 @@
-import json
 from django import forms
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.template.loader import get_template
 from django.urls import resolve, reverse
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import get_language, gettext_lazy as _
+from django_scopes import scopes_disabled
 from functools import partial
-from pretix.base.services.cart import CartError
+from pretix.base.models import (
+    CheckinList,
+    Event,
+    Item,
+    ItemVariation,
+    LogEntry,
+    Order,
+    Question,
+    SubEvent,
+)
+from pretix.base.models.event import Event_SettingsStore
+from pretix.base.models.organizer import Organizer_SettingsStore
 from pretix.base.signals import (
+    checkin_annulled,
+    checkin_created,
     layout_text_variables,
+    order_approved,
+    order_canceled,
+    order_changed,
+    order_denied,
+    order_expired,
+    order_modified,
+    order_paid,
+    order_placed,
+    order_reactivated,
+    order_split,
+    periodic_task,
+    register_data_exporters,
     register_data_shredders,
+    register_multievent_data_exporters,
     register_payment_providers,
     validate_cart,
-    register_data_exporters,
 )
 from pretix.control.signals import nav_event_settings, order_info as control_order_info
+from pretix.helpers.periodic import minimum_interval
 from pretix.presale.signals import (
     checkout_confirm_page_content,
     checkout_flow_steps,
     contact_form_fields,
+    html_head,
     order_info as presale_order_info,
-    order_meta_from_request, html_head,
+    order_meta_from_request,
 )
 from pretix.presale.views.cart import cart_session
 
-from .checkoutflow import ContactForm
-from .payment import PurpleManualPayment1, PurpleManualPayment2, PurpleManualPayment3
+from .cartrules import validate_cart_rules
+from .checkoutflow import ContactForm, get_order_contact
+from .conf import PurpleSettings
+from .models import OnPremiseContact
+from .payment import (
+    PurpleManualPayment1,
+    PurpleManualPayment2,
+    PurpleManualPayment3,
+    invalidate_payment_matrix,
+)
 from .shredder import OnPremiseContactShredder
-from django.conf import settings
+from .tasks import get_expires_fingerprint, recompute_event_expires
 
 """
 PAYMENT PROVIDERS
@@ -49,6 +88,33 @@ def register_manualpayment(sender, **kwargs):
     ]
 
 
+@receiver(
+    [post_save, post_delete],
+    sender=Event_SettingsStore,
+    dispatch_uid="payment_purpletweaks.invalidate_payment_matrix",
+)
+@receiver(
+    [post_save, post_delete],
+    sender=Organizer_SettingsStore,
+    dispatch_uid="payment_purpletweaks.invalidate_payment_matrix",
+)
+def invalidate_payment_matrix_on_settings_change(sender, instance, **kwargs):
+    key = instance.key
+    if key != "invoice_address_asked" and not key.startswith("payment_purple_"):
+        return
+    if sender is Organizer_SettingsStore:
+        # Events inherit the settings they do not set themselves from the organizer
+        with scopes_disabled():
+            event_pks = list(
+                Event.objects.filter(organizer_id=instance.object_id).values_list(
+                    "pk", flat=True
+                )
+            )
+    else:
+        event_pks = [instance.object_id]
+    transaction.on_commit(lambda: invalidate_payment_matrix(*event_pks))
+
+
 """
 EXPORTERS
 """
@@ -63,6 +129,97 @@ def register_exporters(sender, **kwargs):
     return PortraitPDFCheckinList
 
 
+@receiver(
+    register_data_exporters,
+    dispatch_uid="payment_purpletweaks.registerspreadsheetexporters",
+)
+def register_spreadsheet_exporters(sender, **kwargs):
+    from .exporters import PortraitCheckinList
+
+    return PortraitCheckinList
+
+
+@receiver(
+    register_data_exporters,
+    dispatch_uid="payment_purpletweaks.registerofflineexporters",
+)
+def register_offline_exporters(sender, **kwargs):
+    from .exporters import OfflineCheckinBundle
+
+    return OfflineCheckinBundle
+
+
+@receiver(
+    register_multievent_data_exporters,
+    dispatch_uid="payment_purpletweaks.registermultieventexporters",
+)
+def register_multievent_exporters(sender, **kwargs):
+    # pretix only keeps this signal for event-level plugins for compatibility.
+    # Declaring the plugin as hybrid would require enabling it for the organizer
+    # as well, or all of its event features would be switched off.
+    from .exporters import PortraitPDFCheckinListCollection
+
+    return PortraitPDFCheckinListCollection
+
+
+LABELS_UID = "payment_purpletweaks.invalidate_checkinlist_cache_labels"
+
+
+@receiver(
+    [
+        order_placed,
+        order_paid,
+        order_canceled,
+        order_reactivated,
+        order_expired,
+        order_modified,
+        order_changed,
+        order_approved,
+        order_denied,
+        order_split,
+        checkin_created,
+        checkin_annulled,
+    ],
+    dispatch_uid="payment_purpletweaks.invalidate_checkinlist_cache",
+)
+def invalidate_checkinlist_cache(sender, **kwargs):
+    from .exporters import PortraitPDFCheckinList
+
+    PortraitPDFCheckinList.invalidate_cache(sender)
+
+
+@receiver([post_save, post_delete], sender=CheckinList, dispatch_uid=LABELS_UID)
+@receiver([post_save, post_delete], sender=Item, dispatch_uid=LABELS_UID)
+@receiver([post_save, post_delete], sender=ItemVariation, dispatch_uid=LABELS_UID)
+@receiver([post_save, post_delete], sender=Question, dispatch_uid=LABELS_UID)
+@receiver([post_save, post_delete], sender=SubEvent, dispatch_uid=LABELS_UID)
+def invalidate_checkinlist_cache_on_rename(sender, instance, **kwargs):
+    """
+    The names of check-in lists, products, variations, questions and dates are
+    printed on the list, but renaming them does not touch any order.
+    """
+    from .exporters import PortraitPDFCheckinList
+
+    event = instance.item.event if sender is ItemVariation else instance.event
+    PortraitPDFCheckinList.invalidate_cache(event)
+
+
+@receiver(
+    post_save,
+    sender=LogEntry,
+    dispatch_uid="payment_purpletweaks.invalidate_checkinlist_cache_shredder",
+)
+def invalidate_checkinlist_cache_on_shred(sender, instance, created, **kwargs):
+    """
+    The data shredders update positions and answers in bulk, which neither
+    touches the orders nor sends any of the order signals.
+    """
+    from .exporters import PortraitPDFCheckinList
+
+    if created and instance.action_type == "pretix.event.shredder.completed":
+        PortraitPDFCheckinList.invalidate_cache(instance.event, rows=True)
+
+
 """
 CONTACT STEP
 """
@@ -79,10 +236,7 @@ def register_contact_checkout_step(sender, **kwargs):
     contact_form_fields, dispatch_uid="pretix_purpletweaks.additionalcontactquestion"
 )
 def add_additional_contact_question(sender, **kwargs):
-    if (
-        not sender.settings.get("onpremise_contact_availability", as_type=str)
-        == "optional"
-    ):
+    if PurpleSettings.for_event(sender).contact_availability != "optional":
         return {}
     return {
         "has_onpremise_contact": forms.BooleanField(
@@ -99,27 +253,42 @@ def add_additional_contact_question(sender, **kwargs):
     order_meta_from_request, dispatch_uid="payment_purpletweaks.contactstep_ordermeta"
 )
 def register_order_meta_for_contact_step(sender, request, **kwargs):
+    conf = PurpleSettings.for_event(sender)
+    if not conf.contact_enabled:
+        return {}
     session = cart_session(request)
-    if not (
-        sender.settings.get("onpremise_contact_availability", as_type=str) == "always"
-        or session.get("contact_form_data", {}).get("has_onpremise_contact", False)
-    ):
+    if not conf.contact_requested(session.get("contact_form_data", {})):
         return {}
     return {"onpremise_contact": session.get("onpremise_contact", {})}
 
 
+@receiver(order_placed, dispatch_uid="payment_purpletweaks.contactstep_store")
+def store_onpremise_contact(sender, order, **kwargs):
+    formdata = order.meta_info_data.get("onpremise_contact")
+    if formdata:
+        OnPremiseContact.from_formdata(order, formdata).save()
+
+
+@receiver(order_split, dispatch_uid="payment_purpletweaks.contactstep_split")
+def copy_onpremise_contact(sender, original, split_order, **kwargs):
+    try:
+        contact = original.purple_onpremise_contact
+    except OnPremiseContact.DoesNotExist:
+        return
+    OnPremiseContact.from_formdata(split_order, contact.formdata).save()
+
+
 @receiver(
     checkout_confirm_page_content,
     dispatch_uid="payment_purpletweaks.onpremise_contact_confirmpage_content",
 )
 def register_onpremise_contact_confirmpage_content(sender, request, **kwargs):
+    conf = PurpleSettings.for_event(sender)
+    if not conf.contact_enabled:
+        return ""
     session = cart_session(request)
-    if not (
-        sender.settings.get("onpremise_contact_availability", as_type=str) == "always"
-        or session.get("contact_form_data", {}).get("has_onpremise_contact", False)
-    ):
+    if not conf.contact_requested(session.get("contact_form_data", {})):
         return ""
-    from .checkoutflow import ContactForm
 
     session_info = session.get("onpremise_contact", {})
     contact_info = []
@@ -140,22 +309,15 @@ def register_onpremise_contact_confirmpage_content(sender, request, **kwargs):
 @receiver(layout_text_variables, dispatch_uid="pretix_purpletweaks.layouttextvar_name")
 def add_layout_text_variable(sender, **kwargs):
     def element(pos, order, event, identifier=None):
-        if not order.meta_info or not "onpremise_contact" in json.loads(
-            order.meta_info
-        ):
+        data = get_order_contact(order)
+        if not data:
             return ""
-        return ContactForm.label_formdata(
-            json.loads(order.meta_info)["onpremise_contact"], order.event
-        )[identifier][1]
+        return data[identifier][1]
 
     def street_and_city(pos, order, event):
-        if not order.meta_info or not "onpremise_contact" in json.loads(
-            order.meta_info
-        ):
+        data = get_order_contact(order)
+        if not data:
             return ""
-        data = ContactForm.label_formdata(
-            json.loads(order.meta_info)["onpremise_contact"], order.event
-        )
         # Make it single-line
         street = ", ".join(line.strip() for line in data["street"][1].splitlines())
         return street + ", " + data["city"][1]
@@ -210,49 +372,57 @@ def register_order_info_control_onpremise_contact(sender, order=None, **kwargs):
 def get_order_info_onpremise_contact(order=None, paneltype="panel-default"):
     if not order:
         return ""
-    contact_form_data = json.loads(order.meta_info).get("contact_form_data", {})
+    # Saving the order or its contact updates last_modified, and the event cache
+    # is cleared whenever the event settings are saved.
+    key = "purple_contact_panel_{}_{}_{}_{}".format(
+        order.pk, order.last_modified.timestamp(), paneltype, get_language()
+    )
+    panel = order.event.cache.get(key)
+    if panel is None:
+        panel = _render_order_info_onpremise_contact(order, paneltype)
+        order.event.cache.set(key, panel, timeout=3600)
+    return panel
+
+
+def _render_order_info_onpremise_contact(order, paneltype):
+    contact_form_data = order.meta_info_data.get("contact_form_data", {})
     template = get_template("pretix_purpletweaks/onpremise_contact_card.html")
-    if not (
-        order.event.settings.get("onpremise_contact_availability", as_type=str)
-        == "always"
-        or contact_form_data.get("has_onpremise_contact", False)
-    ):
+    if not PurpleSettings.for_event(order.event).contact_requested(contact_form_data):
         return ""
     else:
-        formdata = json.loads(order.meta_info).get("onpremise_contact")
+        contact = get_order_contact(order)
         return template.render(
             {
                 "message": "",
-                "contact_info": ContactForm.label_formdata(
-                    formdata, order.event
-                ).values()
-                if formdata
-                else None,
+                "contact_info": contact.values() if contact else None,
                 "panelclass": paneltype,
             }
         )
 
+
 """
 CUSTOM CSS
 """
 
-@receiver(html_head, dispatch_uid="pretix_purpletweaks.signals.presale_html_head_customcss")
+
+@receiver(
+    html_head, dispatch_uid="pretix_purpletweaks.signals.presale_html_head_customcss"
+)
 def presale_html_head_customcss(sender, request, **kwargs):
-    custom_css = sender.settings.get("event_page_css", default="", as_type=str)
-    if not custom_css.strip():
-        return ""
-    if not settings.CONFIG_FILE.getboolean('purpletweaks', 'enable_custom_css', fallback=False):
+    conf = PurpleSettings.for_event(sender)
+    if not conf.custom_css:
         return ""
     template = get_template("pretix_purpletweaks/custom_css.html")
     ctx = {
         "event": sender,
-        "version": hash(sender.settings.event_page_css),
+        "url": (
+            default_storage.url(conf.custom_css_file) if conf.custom_css_file else None
+        ),
+        "version": conf.custom_css_checksum,
     }
     return template.render(ctx)
 
 
-
-
 """
 MISC
 """
@@ -263,19 +433,40 @@ MISC
     dispatch_uid="payment_purpletweaks.validate_cart_no_multiple_subevents",
 )
 def validate_cart(sender, positions=None, **kwargs):
-    if not sender.has_subevents or not positions:
-        return
-    if not sender.settings.get("block_multisubevent_checkout", as_type=bool):
+    if not positions:
         return
-    subevent = positions[0].subevent
-    for pos in positions[1:]:
-        if subevent != pos.subevent:
-            raise CartError(
-                _(
-                    "Sorry, you can only choose one event per order. "
-                    "Please create multiple orders to participate on multiple dates."
-                )
-            )
+    rules = PurpleSettings.for_event(sender).cart_rules
+    if rules:
+        validate_cart_rules(sender, rules, positions)
+
+
+@receiver(periodic_task, dispatch_uid="payment_purpletweaks.recompute_expires")
+@scopes_disabled()
+@minimum_interval(minutes_after_success=60)
+def recompute_expires_periodically(sender, **kwargs):
+    """
+    Applies the expiration date rules of the purple payment providers again to
+    the pending orders of events whose rules or dates changed since the last run.
+    The first run for an event only records the current state, so expiration
+    dates that were changed by hand are left alone until something changes.
+    """
+    pending = Order.objects.filter(event=OuterRef("pk"), status=Order.STATUS_PENDING)
+    events = (
+        Event.objects.filter(plugins__contains="pretix_purpletweaks")
+        .filter(Exists(pending))
+        .select_related("organizer")
+    )
+    for event in events:
+        fingerprint = get_expires_fingerprint(event)
+        last = event.settings.get("purple_expires_fingerprint", as_type=str)
+        if last == fingerprint:
+            continue
+        if not last:
+            event.settings.set("purple_expires_fingerprint", fingerprint)
+            continue
+        recompute_event_expires.apply_async(
+            kwargs={"event": event.pk, "fingerprint": fingerprint}
+        )
 
 
 @receiver(nav_event_settings, dispatch_uid="pretix_purpletweaks.mainsettings")
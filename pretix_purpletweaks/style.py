@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import rcssmin
+import re
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Tokens whose content must not be mistaken for rules: the comments rcssmin
+# keeps, strings and url()
+TOKEN = re.compile(
+    r"""(/\*.*?\*/)|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|url\((?:[^)"'\\]|\\.)*\)""",
+    re.IGNORECASE | re.DOTALL,
+)
+# A rule without declarations, once comments are replaced by \x01n\x01 and the
+# other tokens by \x00n\x00. A rule can start after a comment, but not after a
+# string, which might be part of its selector.
+EMPTY_RULE = re.compile(r"(?<![^{};\x01])[^{};\x01]+\{\}")
+PLACEHOLDER = re.compile(r"([\x00\x01])(\d+)\1")
+
+
+def css_checksum(css):
+    return hashlib.sha256(css.encode()).hexdigest()[:16]
+
+
+def minify_css(css):
+    """
+    Strips whitespace, comments (except ``/*! ... */`` license comments) and rules
+    without any declarations, including at-rules that only contained such rules.
+    """
+    css = rcssmin.cssmin(css, keep_bang_comments=True)
+    tokens = []
+
+    def placeholder(match):
+        tokens.append(match.group())
+        marker = "\x01" if match.group(1) else "\x00"
+        return "{0}{1}{0}".format(marker, len(tokens) - 1)
+
+    css = TOKEN.sub(placeholder, css)
+    while True:
+        stripped = EMPTY_RULE.sub("", css)
+        if stripped == css:
+            break
+        css = stripped
+    return PLACEHOLDER.sub(lambda match: tokens[int(match.group(2))], css)
+
+
+def custom_css_enabled():
+    """
+    Custom CSS must be enabled in ``pretix.cfg`` for security reasons.
+    """
+    return settings.CONFIG_FILE.getboolean(
+        "purpletweaks", "enable_custom_css", fallback=False
+    )
+
+
+def custom_css_budget():
+    """
+    Maximum size of the minified CSS in bytes as configured in ``pretix.cfg``,
+    ``0`` disables the limit.
+    """
+    return settings.CONFIG_FILE.getint(
+        "purpletweaks", "custom_css_max_bytes", fallback=100 * 1024
+    )
+
+
+def publish_custom_css(event):
+    """
+    Writes the custom CSS of an event to the storage under a name derived from
+    its content, next to gzip and, if brotli is installed, brotli compressed
+    copies that the web server can hand out directly. Since the name changes with
+    the content, the file can be cached forever. If custom CSS is disabled, a
+    previously published file is removed instead.
+    """
+    css = event.settings.get("event_page_css", default="", as_type=str)
+    old = event.settings.get("purple_css_file", as_type=str)
+    new = None
+    if css.strip() and custom_css_enabled():
+        checksum = css_checksum(css)
+        if old and event.settings.get("purple_css_checksum") == checksum:
+            return old
+        data = minify_css(css).encode()
+        new = default_storage.save(
+            "pub/{}/{}/purple.{}.css".format(
+                event.organizer.slug, event.slug, checksum
+            ),
+            ContentFile(data),
+        )
+        _save_variant(new + ".gz", gzip.compress(data, mtime=0))
+        if brotli:
+            _save_variant(new + ".br", brotli.compress(data))
+        event.settings.set("purple_css_file", new)
+        event.settings.set("purple_css_checksum", checksum)
+    else:
+        event.settings.delete("purple_css_file")
+        event.settings.delete("purple_css_checksum")
+    if old and old != new:
+        for name in (old, old + ".gz", old + ".br"):
+            if default_storage.exists(name):
+                default_storage.delete(name)
+    return new
+
+
+def _save_variant(name, data):
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(data))
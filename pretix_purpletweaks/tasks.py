@@ -0,0 +1,122 @@
+import hashlib
+import json
+import pytz
+from django.db.models import Max, OuterRef, Subquery
+from pretix.base.models import Event, Order, OrderPayment, OrderPosition
+from pretix.base.services.tasks import EventTask
+from pretix.celery_app import app
+
+from .datediff import date_diff_wrapper_from_string
+from .payment import get_payment_matrix
+
+
+def get_expires_rules(event):
+    """
+    The expiration date rules of the purple payment providers of the event, by
+    provider identifier.
+    """
+    return {
+        identifier: date_diff_wrapper_from_string(availability["overwrite_expires"])
+        for identifier, availability in get_payment_matrix(event).items()
+        if availability["overwrite_expires"]
+    }
+
+
+def get_expires_fingerprint(event):
+    """
+    Summary of everything the expiration dates set by the purple payment
+    providers depend on: the rules and the dates of the event and its subevents.
+    """
+    rules = get_expires_rules(event)
+    data = [
+        sorted((identifier, rule.to_string()) for identifier, rule in rules.items()),
+        event.settings.timezone,
+    ]
+    if any(rule.data.mode == "before_event" for rule in rules.values()):
+        data.append(event.date_from.isoformat())
+        data.append(
+            [
+                (pk, date_from.isoformat())
+                for pk, date_from in event.subevents.order_by("pk").values_list(
+                    "pk", "date_from"
+                )
+            ]
+        )
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+def recompute_expires(event, dry_run=False, batch_size=1000):
+    """
+    Applies the current expiration date rules of the purple payment providers to
+    all pending orders of the event whose latest open payment uses one of them,
+    just like ``PurplePaymentMixin.execute_payment`` does when the payment is
+    created. Returns the number of orders checked and the number of orders whose
+    expiration date changed, or would change for a dry run.
+    """
+    rules = get_expires_rules(event)
+    if not rules:
+        return 0, 0
+    tz = pytz.timezone(event.settings.timezone)
+
+    provider = (
+        OrderPayment.objects.filter(
+            order=OuterRef("pk"),
+            state__in=(
+                OrderPayment.PAYMENT_STATE_CREATED,
+                OrderPayment.PAYMENT_STATE_PENDING,
+            ),
+        )
+        .order_by("-local_id")
+        .values("provider")[:1]
+    )
+    orders = (
+        event.orders.filter(status=Order.STATUS_PENDING)
+        .annotate(purple_provider=Subquery(provider))
+        .filter(purple_provider__in=rules.keys())
+        .only("pk", "event", "datetime", "expires")
+        .order_by("pk")
+    )
+    if event.has_subevents:
+        last_subevent_date = (
+            OrderPosition.objects.filter(order=OuterRef("pk"))
+            .order_by()
+            .values("order")
+            .annotate(m=Max("subevent__date_from"))
+            .values("m")
+        )
+        orders = orders.annotate(purple_event_date=Subquery(last_subevent_date))
+
+    checked = changed = 0
+    batch = []
+    for order in orders.iterator(chunk_size=batch_size):
+        checked += 1
+        event_date_from = (
+            order.purple_event_date if event.has_subevents else event.date_from
+        )
+        rule = rules[order.purple_provider]
+        if rule.data.mode == "before_event" and not event_date_from:
+            continue
+        expires = rule.resolve(order.datetime, event_date_from, tz).replace(
+            hour=23, minute=59, second=59
+        )
+        if expires != order.expires:
+            order.expires = expires
+            batch.append(order)
+        if len(batch) >= batch_size:
+            changed += _save_expires(batch, dry_run)
+            batch = []
+    changed += _save_expires(batch, dry_run)
+    return checked, changed
+
+
+def _save_expires(orders, dry_run):
+    if orders and not dry_run:
+        Order.objects.bulk_update(orders, ["expires"])
+    return len(orders)
+
+
+@app.task(base=EventTask)
+def recompute_event_expires(event: Event, fingerprint: str = None) -> None:
+    recompute_expires(event)
+    if fingerprint:
+        event.settings.set("purple_expires_fingerprint", fingerprint)
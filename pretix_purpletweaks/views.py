@@ -1,19 +1,41 @@
 from django import forms
+from django.conf import settings
+from django.contrib import messages
+from django.http import HttpResponse
 from django.urls import resolve, reverse
+from django.utils.cache import patch_cache_control
 from django.utils.translation import gettext_lazy as _
+from django.views.decorators.http import condition
 from i18nfield.forms import I18nFormField, I18nTextInput
 from pretix.base.forms import SettingsForm
-from django.http import HttpResponse
 from pretix.base.models import Event
 from pretix.control.views.event import EventSettingsFormView, EventSettingsViewMixin
 from pretix.multidomain.urlreverse import eventreverse
 from pretix.presale.views.order import OrderDownload
-from django.conf import settings
+
+from .conf import PurpleSettings
+from .style import custom_css_budget, minify_css, publish_custom_css
+
 
 class PurpleSettingsForm(SettingsForm):
     block_multisubevent_checkout = forms.BooleanField(
         label=_("Block checkout with positions for multiple subevents"), required=False
     )
+    max_subevents_per_order = forms.IntegerField(
+        label=_("Maximum number of subevents per order"),
+        help_text=_("Leave empty for no limit."),
+        min_value=1,
+        required=False,
+    )
+    max_subevent_span_days = forms.IntegerField(
+        label=_("Maximum number of days spanned by the subevents of an order"),
+        help_text=_(
+            "For example, 7 allows a Monday and the following Sunday, but not the "
+            "Monday after. Leave empty for no limit."
+        ),
+        min_value=1,
+        required=False,
+    )
     onpremise_contact_availability = forms.ChoiceField(
         label=_("Let customers provide emergency contact information"),
         choices=[
@@ -29,6 +51,20 @@ class PurpleSettingsForm(SettingsForm):
         help_text=_("CSS to render on event related pages. This feature must be enabled in the config file.")
     )
 
+    def clean_event_page_css(self):
+        css = self.cleaned_data["event_page_css"]
+        size = len(minify_css(css).encode())
+        self.event_page_css_sizes = (len(css.encode()), size)
+        budget = custom_css_budget()
+        if budget and size > budget:
+            raise forms.ValidationError(
+                _(
+                    "The CSS takes up {size} bytes after minification, but at most "
+                    "{budget} bytes are allowed."
+                ).format(size=size, budget=budget)
+            )
+        return css
+
 
 class SettingsView(EventSettingsViewMixin, EventSettingsFormView):
     model = Event
@@ -36,6 +72,28 @@ class SettingsView(EventSettingsViewMixin, EventSettingsFormView):
     template_name = "pretix_purpletweaks/settings.html"
     permission = "can_change_event_settings"
 
+    def get_form(self, form_class=None):
+        self.form = super().get_form(form_class)
+        return self.form
+
+    def form_success(self):
+        if "event_page_css" in self.form.changed_data and self.form.cleaned_data.get(
+            "event_page_css"
+        ):
+            messages.info(
+                self.request,
+                _(
+                    "The event page CSS has been minified from {before} to {after} "
+                    "bytes."
+                ).format(
+                    before=self.form.event_page_css_sizes[0],
+                    after=self.form.event_page_css_sizes[1],
+                ),
+            )
+        publish_custom_css(self.request.event)
+        self.request.event.cache.clear()
+        PurpleSettings.invalidate(self.request.event)
+
     def get_success_url(self) -> str:
         return reverse(
             "control:event.settings",
@@ -46,10 +104,19 @@ class SettingsView(EventSettingsViewMixin, EventSettingsFormView):
         )
 
 
+def custom_css_etag(request, *args, **kwargs):
+    return PurpleSettings.for_event(request.event).custom_css_checksum
+
+
+@condition(etag_func=custom_css_etag)
 def custom_css(request, *args, **kwargs):
-    event = request.event
-    css_content = event.settings.event_page_css
-    return HttpResponse(
-        css_content,
+    """
+    Fallback for events whose CSS has not been published to the storage yet.
+    """
+    response = HttpResponse(
+        minify_css(PurpleSettings.for_event(request.event).event_page_css),
         content_type="text/css",
     )
+    # The page links to this view with the checksum in the query string
+    patch_cache_control(response, public=True, max_age=24 * 3600)
+    return response
@@ -1 +1,162 @@
 # put your pytest fixtures here
+import json
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Event, Order, OrderPayment, Organizer
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("purpletweaks benchmarks")
+    group.addoption(
+        "--benchmark",
+        action="store_true",
+        help="Run the (slow) scaling benchmarks of the exporters.",
+    )
+    group.addoption(
+        "--benchmark-sizes",
+        default="1000,10000,100000",
+        help="Comma-separated numbers of positions to benchmark with.",
+    )
+    group.addoption(
+        "--benchmark-json",
+        default=None,
+        help="Write the benchmark results to this file.",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: slow scaling benchmark")
+    config._purple_benchmarks = []
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="needs --benchmark to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = config._purple_benchmarks
+    if not results:
+        return
+    terminalreporter.section("purpletweaks benchmarks")
+    columns = list(results[0])
+    terminalreporter.write_line(" ".join("{:>12}".format(c) for c in columns))
+    for result in results:
+        terminalreporter.write_line(
+            " ".join("{:>12}".format(result[c]) for c in columns)
+        )
+    path = config.getoption("--benchmark-json")
+    if path:
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+@pytest.fixture
+def benchmark_results(request):
+    return request.config._purple_benchmarks
+
+
+@pytest.fixture(scope="session")
+def django_db_modify_db_settings(
+    django_db_modify_db_settings_parallel_suffix, tmp_path_factory
+):
+    # The workers of parallel exports open connections of their own, which would
+    # each get an empty database if it only lived in memory
+    db = settings.DATABASES["default"]
+    if db["ENGINE"] == "django.db.backends.sqlite3":
+        db["TEST"]["NAME"] = str(tmp_path_factory.mktemp("db") / "test.sqlite3")
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+
+
+@pytest.fixture
+def organizer():
+    return Organizer.objects.create(name="Dummy", slug="dummy")
+
+
+@pytest.fixture
+@scopes_disabled()
+def event(organizer):
+    return Event.objects.create(
+        organizer=organizer,
+        name="Dummy",
+        slug="dummy",
+        date_from=now() + timedelta(days=7),
+        plugins="pretix_purpletweaks",
+    )
+
+
+@pytest.fixture
+@scopes_disabled()
+def item(event):
+    return event.items.create(name="Ticket", default_price=Decimal("23.00"))
+
+
+@pytest.fixture
+@scopes_disabled()
+def question(event, item):
+    q = event.questions.create(question="Allergies", type="T")
+    q.items.add(item)
+    return q
+
+
+@pytest.fixture
+@scopes_disabled()
+def checkin_list(event):
+    return event.checkin_lists.create(
+        name="Default", all_products=True, include_pending=True
+    )
+
+
+@pytest.fixture
+def make_order(event, item, question):
+    counter = iter(range(10000))
+
+    @scopes_disabled()
+    def make(paid=True, answer="Nuts"):
+        i = next(counter)
+        order = Order.objects.create(
+            event=event,
+            code="ORD{:04d}".format(i),
+            status=Order.STATUS_PAID if paid else Order.STATUS_PENDING,
+            email="dummy{}@example.org".format(i),
+            datetime=now(),
+            expires=now() + timedelta(days=10),
+            total=item.default_price,
+            sales_channel=event.organizer.sales_channels.get(identifier="web"),
+        )
+        order.payments.create(
+            provider="manual",
+            amount=order.total,
+            state=(
+                OrderPayment.PAYMENT_STATE_CONFIRMED
+                if paid
+                else OrderPayment.PAYMENT_STATE_CREATED
+            ),
+        )
+        position = order.positions.create(
+            item=item,
+            price=item.default_price,
+            attendee_name_parts={
+                "_scheme": "full",
+                "full_name": "Attendee {}".format(i),
+            },
+        )
+        if answer:
+            position.answers.create(question=question, answer=answer)
+        return order
+
+    return make
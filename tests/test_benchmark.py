@@ -0,0 +1,241 @@
+import pytest
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import (
+    Checkin,
+    Event,
+    Order,
+    OrderPayment,
+    OrderPosition,
+    QuestionAnswer,
+    Seat,
+)
+
+from pretix_purpletweaks.exporters import PortraitPDFCheckinList
+
+BATCH_SIZE = 2000
+NAMES = [
+    "Kim",
+    "Alex Meyer",
+    "Maria Dolores Fernández García",
+    "Jean-Baptiste Emmanuel Zorg-Wellington",
+]
+ANSWERS = [
+    "",
+    "Nuts",
+    "Vegan, no gluten",
+    "Lactose intolerant &amp; allergic to <b>shellfish</b>",
+    "Needs a wheelchair accessible seat near the stage entrance. " * 4,
+]
+
+
+def pytest_generate_tests(metafunc):
+    if "positions" in metafunc.fixturenames:
+        sizes = metafunc.config.getoption("--benchmark-sizes")
+        metafunc.parametrize(
+            "positions", [int(s) for s in sizes.split(",") if s.strip()]
+        )
+
+
+def create_synthetic_event(organizer, positions):
+    """
+    Creates an event series with ``positions`` order positions spread over
+    four dates. The orders vary in payment state, add-ons, seats, answers,
+    blocked tickets and check-ins, and are bulk inserted without going through
+    the order logic, so even large events are set up in a few seconds.
+    """
+    event = Event.objects.create(
+        organizer=organizer,
+        name="Benchmark",
+        slug="benchmark",
+        date_from=now() + timedelta(days=7),
+        has_subevents=True,
+        plugins="pretix_purpletweaks",
+    )
+    subevents = [
+        event.subevents.create(
+            name="Date {}".format(i), date_from=now() + timedelta(days=7 + i)
+        )
+        for i in range(4)
+    ]
+    ticket = event.items.create(name="Ticket", default_price=Decimal("23.00"))
+    variations = [ticket.variations.create(value=v) for v in ("Regular", "Reduced")]
+    workshop = event.items.create(name="Workshop", default_price=Decimal("5.00"))
+    questions = [
+        event.questions.create(question="Allergies", type="T"),
+        event.questions.create(question="Comment", type="T"),
+    ]
+    checkin_list = event.checkin_lists.create(
+        name="Everyone", all_products=True, include_pending=True
+    )
+    sales_channel = organizer.sales_channels.get(identifier="web")
+
+    orders = []
+    tickets = []
+    i = 0
+    while len(tickets) < positions:
+        paid = i % 10 < 6
+        free = i % 10 == 9
+        order = Order(
+            event=event,
+            organizer=organizer,
+            code="B{:07d}".format(i),
+            status=Order.STATUS_PAID if paid or free else Order.STATUS_PENDING,
+            email="attendee{}@example.org".format(i),
+            datetime=now(),
+            expires=now() + timedelta(days=10),
+            total=Decimal("0.00") if free else Decimal("23.00"),
+            sales_channel=sales_channel,
+        )
+        orders.append(order)
+        tickets.append((order, i))
+        if i % 5 == 0 and len(tickets) < positions:
+            tickets.append((order, None))
+        i += 1
+    Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+
+    payments = []
+    for i, order in enumerate(orders):
+        if order.total == 0:
+            provider, state = "free", OrderPayment.PAYMENT_STATE_CONFIRMED
+        elif order.status == Order.STATUS_PAID:
+            provider, state = "manual", OrderPayment.PAYMENT_STATE_CONFIRMED
+        elif i % 2:
+            provider, state = "manual", OrderPayment.PAYMENT_STATE_CREATED
+        else:
+            continue
+        payments.append(
+            OrderPayment(
+                order=order,
+                local_id=1,
+                provider=provider,
+                amount=order.total,
+                state=state,
+            )
+        )
+    OrderPayment.objects.bulk_create(payments, batch_size=BATCH_SIZE)
+
+    seats = Seat.objects.bulk_create(
+        [
+            Seat(
+                event=event,
+                subevent=subevents[j % len(subevents)],
+                row_name=str(j // 40 + 1),
+                seat_number=str(j % 40 + 1),
+                seat_guid="seat-{}".format(j),
+            )
+            for j in range(len(tickets) // 3 + 1)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    ops = []
+    for j, (order, i) in enumerate(tickets):
+        subevent = subevents[(i if i is not None else j) % len(subevents)]
+        if i is None:
+            # the add-on belongs to the ticket created just before it
+            op = OrderPosition(item=workshop, price=Decimal("5.00"), positionid=2)
+        else:
+            op = OrderPosition(
+                item=ticket,
+                variation=variations[i % 2] if i % 3 else None,
+                price=order.total,
+                positionid=1,
+                attendee_name_parts={
+                    "_scheme": "full",
+                    "full_name": "{} {}".format(NAMES[i % len(NAMES)], i),
+                },
+                seat=seats[j // 3] if j % 3 == 0 else None,
+                blocked=["admin"] if i % 97 == 0 else None,
+            )
+        op.order = order
+        op.organizer = organizer
+        op.subevent = subevent
+        op.tax_rate = op.tax_value = Decimal("0.00")
+        op.secret = "secret{}".format(j)
+        op.pseudonymization_id = "P{:09d}".format(j)
+        ops.append(op)
+    OrderPosition.all.bulk_create(ops, batch_size=BATCH_SIZE)
+    addons = [
+        OrderPosition(pk=op.pk, addon_to_id=ops[j - 1].pk)
+        for j, op in enumerate(ops)
+        if op.item_id == workshop.pk
+    ]
+    OrderPosition.all.bulk_update(addons, ["addon_to"], batch_size=BATCH_SIZE)
+
+    QuestionAnswer.objects.bulk_create(
+        [
+            QuestionAnswer(
+                orderposition=op,
+                question=question,
+                answer=ANSWERS[(j + k) % len(ANSWERS)],
+            )
+            for j, op in enumerate(ops)
+            for k, question in enumerate(questions)
+            if ANSWERS[(j + k) % len(ANSWERS)]
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    Checkin.objects.bulk_create(
+        [
+            Checkin(position=op, list=checkin_list, type=Checkin.TYPE_ENTRY)
+            for j, op in enumerate(ops)
+            if j % 4 == 0
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    return event, checkin_list, questions
+
+
+def _render(event, form_data):
+    exporter = PortraitPDFCheckinList(event, event.organizer)
+    exporter.processes = 1
+    return exporter.render(form_data)[2]
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+@pytest.mark.parametrize("chunked", [False, True], ids=["table", "chunked"])
+@scopes_disabled()
+def test_portrait_checkin_list_scaling(
+    organizer, benchmark_results, positions, chunked
+):
+    event, checkin_list, questions = create_synthetic_event(organizer, positions)
+    form_data = {
+        "list": checkin_list.pk,
+        "questions": [q.pk for q in questions],
+        "sort": "name",
+        "chunked": chunked,
+    }
+
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        data = _render(event, form_data)
+        seconds = time.perf_counter() - start
+    assert data.startswith(b"%PDF")
+
+    # tracemalloc slows the render down considerably, so memory is measured in
+    # a separate pass to keep the timing above meaningful
+    tracemalloc.start()
+    try:
+        _render(event, form_data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    benchmark_results.append(
+        {
+            "positions": positions,
+            "mode": "chunked" if chunked else "table",
+            "seconds": round(seconds, 2),
+            "queries": len(ctx.captured_queries),
+            "peak_mib": round(peak / 1024 / 1024, 1),
+            "pdf_kib": round(len(data) / 1024),
+        }
+    )
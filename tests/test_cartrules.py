@@ -0,0 +1,83 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from django_scopes import scopes_disabled
+from pretix.base.models import Event
+from pretix.base.services.cart import CartError
+from types import SimpleNamespace
+
+from pretix_purpletweaks.conf import PurpleSettings
+from pretix_purpletweaks.signals import validate_cart
+
+
+@pytest.fixture
+@scopes_disabled()
+def series(organizer):
+    event = Event.objects.create(
+        organizer=organizer,
+        name="Series",
+        slug="series",
+        date_from=datetime(2030, 6, 3, 10, tzinfo=timezone.utc),
+        has_subevents=True,
+        plugins="pretix_purpletweaks",
+    )
+    # a Monday, the Sunday after and the next Monday
+    for days in (0, 6, 7):
+        event.subevents.create(
+            name="Date", date_from=event.date_from + timedelta(days=days)
+        )
+    return event
+
+
+def _validate(event, subevents, **settings):
+    for key, value in settings.items():
+        event.settings.set(key, value)
+    PurpleSettings.invalidate(event)
+    positions = [SimpleNamespace(subevent_id=s.pk, item_id=1) for s in subevents]
+    validate_cart(event, positions=positions)
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_no_rules(series, django_assert_num_queries):
+    subevents = list(series.subevents.order_by("date_from"))
+    _validate(series, subevents)
+    with django_assert_num_queries(0):
+        validate_cart(
+            series, positions=[SimpleNamespace(subevent_id=s.pk) for s in subevents]
+        )
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_single_subevent(series):
+    first, sunday, monday = series.subevents.order_by("date_from")
+    _validate(series, [first, first], block_multisubevent_checkout=True)
+    with pytest.raises(CartError, match="only choose one event"):
+        _validate(series, [first, sunday])
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_max_subevents(series, django_assert_num_queries):
+    first, sunday, monday = series.subevents.order_by("date_from")
+    _validate(series, [first, sunday, first], max_subevents_per_order=2)
+    with pytest.raises(CartError, match="up to 2 dates"):
+        _validate(series, [first, sunday, monday])
+
+    # evaluated from the ids alone, however large the cart is
+    positions = [SimpleNamespace(subevent_id=first.pk, item_id=1)] * 500
+    with django_assert_num_queries(0):
+        validate_cart(series, positions=positions)
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_subevent_span(series, django_assert_num_queries):
+    first, sunday, monday = series.subevents.order_by("date_from")
+    _validate(series, [first, sunday], max_subevent_span_days=7)
+    with pytest.raises(CartError, match="within 7 days"):
+        _validate(series, [first, sunday, monday])
+
+    positions = [SimpleNamespace(subevent_id=s.pk, item_id=1) for s in [first, sunday]]
+    with django_assert_num_queries(1):
+        validate_cart(series, positions=positions * 100)
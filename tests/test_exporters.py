@@ -0,0 +1,523 @@
+import csv
+import pytest
+import sqlite3
+from datetime import datetime, timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from io import BytesIO, StringIO
+from pretix.base.models import Event, OrderPayment
+from pretix.base.shredder import AttendeeInfoShredder, QuestionAnswerShredder
+from pretix.base.signals import order_paid
+from pretix.helpers.database import repeatable_reads_transaction
+from pypdf import PdfReader
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from zipfile import ZipFile
+
+from pretix_purpletweaks.exporters import (
+    OfflineCheckinBundle,
+    ParagraphFitter,
+    PortraitCheckinList,
+    PortraitPDFCheckinList,
+    PortraitPDFCheckinListCollection,
+)
+from pretix_purpletweaks.models import OnPremiseContact
+
+
+def _render(event, checkin_list, question):
+    exporter = PortraitPDFCheckinList(event, event.organizer)
+    form_data = {"list": checkin_list.pk, "questions": [question.pk]}
+    with CaptureQueriesContext(connection) as ctx:
+        filename, mimetype, data = exporter.render(form_data)
+    assert mimetype == "application/pdf"
+    assert data.startswith(b"%PDF")
+    return len(ctx.captured_queries)
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_query_count_is_constant(
+    event, checkin_list, question, make_order
+):
+    # the first export warms up caches that are not related to the list size
+    make_order()
+    _render(event, checkin_list, question)
+
+    for i in range(3):
+        make_order(paid=i % 2 == 0)
+    few = _render(event, checkin_list, question)
+
+    for i in range(12):
+        make_order(paid=i % 2 == 0, answer="Nuts " * i)
+    many = _render(event, checkin_list, question)
+
+    assert few == many
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_chunked(event, checkin_list, question, make_order):
+    orders = [make_order(paid=i % 2 == 0) for i in range(5)]
+
+    exporter = PortraitPDFCheckinList(event, event.organizer)
+    exporter.chunk_size = 2
+    filename, mimetype, data = exporter.render(
+        {"list": checkin_list.pk, "questions": [question.pk], "chunked": True}
+    )
+
+    text = "".join(page.extract_text() for page in PdfReader(BytesIO(data)).pages)
+    for order in orders:
+        assert order.code in text
+    assert text.count("Allergies") == 3
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_shares_forms(event, checkin_list, question, make_order):
+    for i in range(5):
+        make_order(paid=i % 2 == 0)
+
+    exporter = PortraitPDFCheckinList(event, event.organizer)
+    exporter.chunk_size = 2
+    data = exporter.render(
+        {"list": checkin_list.pk, "questions": [question.pk], "chunked": True}
+    )[2]
+
+    # one checkbox and one rotated header, however often they are drawn
+    assert data.count(b"/Subtype /Form") == 2
+    page = PdfReader(BytesIO(data)).pages[0]
+    assert "paid" in page.extract_text()
+    assert len(page["/Resources"]["/XObject"]) == 2
+    assert b"ASCII85Decode" not in data
+
+
+@pytest.mark.django_db(transaction=True)
+@scopes_disabled()
+def test_portrait_checkin_list_parallel(
+    event, checkin_list, question, make_order, monkeypatch
+):
+    orders = [make_order(paid=i % 2 == 0) for i in range(7)]
+    monkeypatch.setattr(PortraitPDFCheckinList, "processes", 3)
+    monkeypatch.setattr(PortraitPDFCheckinList, "min_segment_size", 2)
+
+    exporter = PortraitPDFCheckinList(event, event.organizer)
+    assert not exporter.repeatable_read
+    assert [
+        len(s["positions"]) for s in exporter._get_segments({"list": checkin_list.pk})
+    ] == [3, 3, 1]
+    # pretix stores some defaults of the payment providers when they are first
+    # loaded, which SQLite would not allow the workers while the parent reads
+    event.get_payment_providers()
+    # the segments are rendered by forked workers, which must not use the
+    # connection of the parent even if it is in a transaction
+    with repeatable_reads_transaction():
+        filename, mimetype, data = exporter.render(
+            {"list": checkin_list.pk, "questions": [question.pk]}
+        )
+        assert Event.objects.filter(pk=event.pk).exists()
+
+    pages = [page.extract_text() for page in PdfReader(BytesIO(data)).pages]
+    assert len(pages) == 3
+    for i, text in enumerate(pages, start=1):
+        assert "Page {} of 3".format(i) in text
+        assert "Allergies" in text
+    assert pages[0].count("Default") == 1
+    assert all("Default" not in text for text in pages[1:])
+    for order in orders:
+        assert order.code in "".join(pages)
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_cache(
+    locmem_cache, event, checkin_list, question, make_order
+):
+    order = make_order()
+    form_data = {"list": checkin_list.pk, "questions": [question.pk]}
+
+    def render():
+        exporter = PortraitPDFCheckinList(event, event.organizer)
+        with CaptureQueriesContext(connection) as ctx:
+            data = exporter.render(form_data)[2]
+        return data, len(ctx.captured_queries)
+
+    first, _ = render()
+    cached, queries = render()
+    assert cached == first
+    # load the check-in list and compute the fingerprint
+    assert queries == 2
+
+    order.positions.first().answers.update(answer="Peanuts")
+    order.touch()
+    queries = render()[1]
+    assert queries > 2
+    assert render()[1] == 2
+
+    order_paid.send(event, order=order)
+    assert render()[1] > 2
+    assert render()[1] == 2
+
+    # labels printed on the list are not versioned by the orders
+    checkin_list.name = "Doors"
+    checkin_list.save()
+    data, queries = render()
+    assert queries > 2
+    assert "Doors" in PdfReader(BytesIO(data)).pages[0].extract_text()
+    question.question = "Intolerances"
+    question.save()
+    data, queries = render()
+    assert "Intolerances" in PdfReader(BytesIO(data)).pages[0].extract_text()
+    variation = order.positions.first().item.variations.create(value="Reduced")
+    assert render()[1] > 2
+    variation.value = "Discounted"
+    variation.save()
+    assert render()[1] > 2
+
+    # the data shredders do not touch the orders either
+    render()
+    assert render()[1] == 2
+    event.log_action("pretix.event.shredder.completed")
+    assert render()[1] > 2
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_changed_since(
+    event, checkin_list, question, make_order, django_capture_on_commit_callbacks
+):
+    old = make_order()
+    changed = make_order(paid=False)
+
+    def render(**kwargs):
+        exporter = PortraitPDFCheckinList(event, event.organizer)
+        with django_capture_on_commit_callbacks(execute=True):
+            data = exporter.render(
+                dict(list=checkin_list.pk, questions=[question.pk], **kwargs)
+            )[2]
+        return "".join(p.extract_text() for p in PdfReader(BytesIO(data)).pages)
+
+    # without a previous export, the whole list is rendered
+    text = render(changed_only=True)
+    assert old.code in text and changed.code in text
+    assert "Changes since" not in text
+
+    changed.payments.update(state=OrderPayment.PAYMENT_STATE_CONFIRMED)
+    changed.touch()
+    new = make_order()
+    text = render(changed_only=True)
+    assert "Changes since" in text
+    assert old.code not in text
+    assert changed.code in text and new.code in text
+
+    text = render(changed_only=True)
+    assert old.code not in text and new.code not in text
+
+    text = render(changed_only=True, changed_since=old.last_modified.isoformat())
+    assert old.code in text and new.code in text
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_last_export(
+    locmem_cache,
+    event,
+    checkin_list,
+    question,
+    make_order,
+    django_capture_on_commit_callbacks,
+):
+    make_order()
+    question.identifier = "ALLERGIES"
+    question.save()
+    key = PortraitPDFCheckinList._get_last_export_key(checkin_list)
+
+    def render(exporter, form_data):
+        with django_capture_on_commit_callbacks(execute=True):
+            exporter.render(form_data)
+        return Event.objects.get(pk=event.pk).settings.get(key, as_type=datetime)
+
+    def render_list(**kwargs):
+        return render(
+            PortraitPDFCheckinList(event, event.organizer),
+            dict(list=checkin_list.pk, questions=[question.pk], **kwargs),
+        )
+
+    # neither full exports nor collections move the baseline of the list
+    assert render_list() is None
+    collection = PortraitPDFCheckinListCollection(
+        Event.objects.filter(pk=event.pk), event.organizer
+    )
+    assert render(collection, {"questions": ["ALLERGIES"]}) is None
+
+    since = (now() - timedelta(days=1)).isoformat()
+    first = render_list(changed_only=True, changed_since=since)
+    assert first is not None
+    # a cached PDF was not exported again
+    assert render_list(changed_only=True, changed_since=since) == first
+    assert render_list(changed_only=True) > first
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_row_cache(
+    locmem_cache, event, checkin_list, question, make_order, monkeypatch
+):
+    orders = [make_order() for i in range(3)]
+    built = []
+    get_cells = PortraitPDFCheckinList._get_cells
+
+    def counting_get_cells(self, op, *args):
+        built.append(op.order.code)
+        return get_cells(self, op, *args)
+
+    monkeypatch.setattr(PortraitPDFCheckinList, "_get_cells", counting_get_cells)
+
+    def render(questions):
+        return PortraitPDFCheckinList(event, event.organizer).render(
+            {"list": checkin_list.pk, "questions": questions, "sort": "code"}
+        )[2]
+
+    first = render([question.pk])
+    assert sorted(built) == [o.code for o in orders]
+
+    built.clear()
+    orders[1].positions.first().answers.update(answer="Peanuts")
+    orders[1].touch()
+    second = render([question.pk])
+    assert built == [orders[1].code]
+    assert "Peanuts" in PdfReader(BytesIO(second)).pages[0].extract_text()
+    assert "Peanuts" not in PdfReader(BytesIO(first)).pages[0].extract_text()
+
+    # the cells depend on the selected questions
+    built.clear()
+    render([])
+    assert len(built) == 3
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_shredded(
+    locmem_cache, event, checkin_list, question, make_order
+):
+    make_order()
+    form_data = {"list": checkin_list.pk, "questions": [question.pk]}
+
+    def render():
+        data = PortraitPDFCheckinList(event, event.organizer).render(form_data)[2]
+        return PdfReader(BytesIO(data)).pages[0].extract_text()
+
+    text = render()
+    assert "Attendee 0" in text
+    assert "Nuts" in text
+
+    # the shredders neither touch the orders nor send order signals
+    AttendeeInfoShredder(event).shred_data()
+    QuestionAnswerShredder(event).shred_data()
+    event.log_action("pretix.event.shredder.completed")
+    text = render()
+    assert "Attendee 0" not in text
+    assert "Nuts" not in text
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_collection(event, checkin_list, question, make_order):
+    order = make_order()
+    question.identifier = "ALLERGIES"
+    question.save()
+    second = event.checkin_lists.create(name="Backstage", all_products=True)
+
+    exporter = PortraitPDFCheckinListCollection(
+        Event.objects.filter(organizer=event.organizer), event.organizer
+    )
+    assert list(exporter.export_form_fields["questions"].choices) == [
+        ("ALLERGIES", "Allergies")
+    ]
+    filename, mimetype, data = exporter.render({"questions": ["ALLERGIES"]})
+    assert filename == "dummy_checkinlists.zip"
+    assert mimetype == "application/zip"
+
+    with ZipFile(BytesIO(data)) as zipf:
+        assert sorted(zipf.namelist()) == [
+            "dummy/{}-Default.pdf".format(checkin_list.pk),
+            "dummy/{}-Backstage.pdf".format(second.pk),
+        ]
+        text = (
+            PdfReader(
+                BytesIO(zipf.read("dummy/{}-Default.pdf".format(checkin_list.pk)))
+            )
+            .pages[0]
+            .extract_text()
+        )
+    assert order.code in text
+    assert "Allergies" in text
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_labels(event, item, checkin_list, make_order):
+    item.name = "Tea & <b>Cake</b>"
+    item.save()
+    make_order()
+    exporter = PortraitPDFCheckinList(event, event.organizer)
+    exporter.register_fonts()
+    op = exporter._get_queryset(checkin_list, {"list": checkin_list.pk}).get()
+
+    # the spreadsheet label and the PDF cell are memoized separately
+    product, subevent, seat = exporter._get_product_lines(op, checkin_list)
+    assert product == "Tea & <b>Cake</b> (€23.00, Manual payment)"
+    cell = exporter._get_row(op, checkin_list, ("Attendee 0", []))[5]
+    assert cell.text == ("Tea &amp; &lt;b&gt;Cake&lt;/b&gt; (€23.00, Manual payment)")
+    assert exporter._get_product_lines(op, checkin_list)[0] == product
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_portrait_checkin_list_spreadsheet(event, checkin_list, question, make_order):
+    def export():
+        exporter = PortraitCheckinList(event, event.organizer)
+        with CaptureQueriesContext(connection) as ctx:
+            filename, mimetype, data = exporter.render(
+                {
+                    "_format": "default",
+                    "list": checkin_list.pk,
+                    "questions": [question.pk],
+                    "sort": "code",
+                }
+            )
+        assert filename == "dummy_checkin_portrait_Default.csv"
+        return list(csv.reader(StringIO(data.decode()))), len(ctx.captured_queries)
+
+    paid = make_order()
+    make_order(paid=False, answer="")
+    export()
+    rows, few = export()
+    assert rows == [
+        [
+            "Requires special attention",
+            "Checked in",
+            "Paid",
+            "Order code",
+            "Name",
+            "Product / Price",
+            "Allergies",
+        ],
+        [
+            "",
+            "No",
+            "Yes",
+            paid.code,
+            "Attendee 0",
+            "Ticket (€23.00, Manual payment)",
+            "Nuts",
+        ],
+        [
+            "",
+            "No",
+            "No",
+            "ORD0001",
+            "Attendee 1",
+            "Ticket (€23.00, Manual payment)",
+            "",
+        ],
+    ]
+
+    for i in range(10):
+        make_order(paid=i % 2 == 0)
+    rows, many = export()
+    assert len(rows) == 13
+    assert few == many
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_offline_checkin_bundle(event, checkin_list, question, make_order, tmp_path):
+    paid = make_order()
+    OnPremiseContact.from_formdata(
+        paid,
+        {
+            "name_parts": {"_scheme": "full", "full_name": "Maria Mayer"},
+            "telephone": "+49 123",
+            "street": "Waldweg 1",
+            "zipcode": "12345",
+            "city": "Musterstadt",
+        },
+    ).save()
+    pending = make_order(paid=False, answer="")
+    position = pending.positions.get()
+    position.attendee_name_parts = {"_scheme": "full", "full_name": "Jürgen  Müller"}
+    position.save()
+
+    exporter = OfflineCheckinBundle(event, event.organizer)
+    filename, mimetype, data = exporter.render(
+        {"list": checkin_list.pk, "questions": [question.pk], "sort": "code"}
+    )
+    assert filename == "dummy_checkin_Default.sqlite3"
+    path = tmp_path / filename
+    path.write_bytes(data)
+
+    db = sqlite3.connect(path)
+    rows = db.execute(
+        "SELECT order_code, name, paid, blocked, checked_in, emergency_name, "
+        "emergency_address FROM positions ORDER BY order_code"
+    ).fetchall()
+    assert rows == [
+        (
+            paid.code,
+            "Attendee 0",
+            1,
+            0,
+            0,
+            "Maria Mayer",
+            "Waldweg 1\n12345 Musterstadt",
+        ),
+        (pending.code, "Jürgen  Müller", 0, 0, 0, None, None),
+    ]
+    assert db.execute(
+        "SELECT a.answer FROM answers a JOIN positions p ON p.id = a.position_id "
+        "WHERE p.order_code = ?",
+        (paid.code,),
+    ).fetchall() == [("Nuts",)]
+
+    search = "SELECT order_code FROM positions WHERE name_normalized LIKE ?"
+    assert db.execute(search, ("jurgen m%",)).fetchall() == [(pending.code,)]
+    plan = db.execute("EXPLAIN QUERY PLAN " + search, ("jurgen%",)).fetchall()
+    assert "positions_name_normalized" in str(plan)
+
+
+def test_paragraph_fitter_cuts_long_text():
+    fitter = ParagraphFitter(getSampleStyleSheet()["Normal"], 20 * mm)
+    text = "Lorem ipsum &amp; dolor<br/>sit amet " * 50
+
+    p = fitter.fit(text, 30 * mm)
+    assert p.text.endswith("...")
+    assert text.startswith(p.text[:-3])
+    assert p.wrap(30 * mm, 5000)[1] <= 20 * mm
+
+    longer = fitter.cut(text, len(p.text) - 3 + 20)
+    assert fitter.height(longer, 30 * mm) > 20 * mm
+
+    measured = len(fitter._heights)
+    assert fitter.fit(text, 30 * mm).text == p.text
+    assert len(fitter._heights) == measured
+
+
+def test_paragraph_fitter_keeps_short_text():
+    fitter = ParagraphFitter(getSampleStyleSheet()["Normal"], 20 * mm)
+    assert fitter.fit("Nuts", 30 * mm).text == "Nuts"
+    assert fitter.fit("", 30 * mm).text == ""
+
+
+def test_highlight_style_merges_consecutive_rows():
+    tstyledata = PortraitPDFCheckinList._get_highlight_style([1, 2, 3, 5], 2)
+    assert tstyledata == [
+        ("BACKGROUND", (2, 1), (2, 3), "#990000"),
+        ("TEXTCOLOR", (2, 1), (2, 3), "#ffffff"),
+        ("ALIGN", (2, 1), (2, 3), "CENTER"),
+        ("BACKGROUND", (2, 5), (2, 5), "#990000"),
+        ("TEXTCOLOR", (2, 5), (2, 5), "#ffffff"),
+        ("ALIGN", (2, 5), (2, 5), "CENTER"),
+    ]
+    assert PortraitPDFCheckinList._get_highlight_style([], 1) == []
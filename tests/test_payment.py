@@ -0,0 +1,77 @@
+import pytest
+from django_scopes import scopes_disabled
+from pretix.base.models import Event
+from types import SimpleNamespace
+
+from pretix_purpletweaks.payment import (
+    PurpleManualPayment1,
+    PurpleManualPayment2,
+    get_payment_matrix,
+)
+
+
+def _request(is_business):
+    return SimpleNamespace(
+        _checkout_flow_invoice_address=SimpleNamespace(is_business=is_business)
+    )
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_payment_matrix(
+    locmem_cache, event, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    event.settings.invoice_address_asked = True
+    first = PurpleManualPayment1(event)
+    first.settings.set("_block_business_customers", True)
+    first.settings.set("_overwrite_expires", "DATEDIFF/14/after_order/")
+
+    event = Event.objects.get(pk=event.pk)
+    assert get_payment_matrix(event) == {
+        "purple_manual": {
+            "individual": True,
+            "business": False,
+            "overwrite_expires": "DATEDIFF/14/after_order/",
+        },
+        "purple_manual_1": {
+            "individual": True,
+            "business": True,
+            "overwrite_expires": None,
+        },
+        "purple_manual_2": {
+            "individual": True,
+            "business": True,
+            "overwrite_expires": None,
+        },
+    }
+
+    # a new request reads the matrix from the cache
+    event = Event.objects.get(pk=event.pk)
+    first, second = PurpleManualPayment1(event), PurpleManualPayment2(event)
+    with django_assert_num_queries(0):
+        assert not first._is_allowed_for_customer_type(request=_request(True))
+        assert first._is_allowed_for_customer_type(request=_request(False))
+        assert second._is_allowed_for_customer_type(request=_request(True))
+
+    with django_capture_on_commit_callbacks(execute=True):
+        first.settings.set("_block_business_customers", False)
+    event = Event.objects.get(pk=event.pk)
+    assert get_payment_matrix(event)["purple_manual"]["business"]
+
+    # customer types are only known if the invoice address is asked for
+    with django_capture_on_commit_callbacks(execute=True):
+        first.settings.set("_block_individual_customers", True)
+        event.settings.invoice_address_asked = False
+    event = Event.objects.get(pk=event.pk)
+    assert get_payment_matrix(event)["purple_manual"]["individual"]
+
+    # the event inherits the setting from its organizer
+    with django_capture_on_commit_callbacks(execute=True):
+        event.settings.delete("invoice_address_asked")
+        event.organizer.settings.invoice_address_asked = True
+    event = Event.objects.get(pk=event.pk)
+    assert not get_payment_matrix(event)["purple_manual"]["individual"]
+    with django_capture_on_commit_callbacks(execute=True):
+        event.organizer.settings.invoice_address_asked = False
+    event = Event.objects.get(pk=event.pk)
+    assert get_payment_matrix(event)["purple_manual"]["individual"]
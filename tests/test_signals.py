@@ -0,0 +1,257 @@
+import importlib
+import json
+import pytest
+from django.apps import apps
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_scopes import scopes_disabled
+from pretix.base.models import Event, Order, OrderPosition
+from pretix.base.signals import order_placed
+
+from pretix_purpletweaks.conf import PurpleSettings
+from pretix_purpletweaks.models import OnPremiseContact
+from pretix_purpletweaks.shredder import OnPremiseContactShredder
+from pretix_purpletweaks.signals import (
+    add_additional_contact_question,
+    add_layout_text_variable,
+    get_order_info_onpremise_contact,
+)
+
+CONTACT = {
+    "name_parts": {"_scheme": "full", "full_name": "Maria Mayer"},
+    "telephone": "+49 123",
+    "street": "Waldweg 1\nHinterhaus",
+    "zipcode": "12345",
+    "city": "Musterstadt",
+}
+
+
+def _contact_queries(ctx):
+    return sum(
+        OnPremiseContact._meta.db_table in query["sql"]
+        for query in ctx.captured_queries
+    )
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_contact_stored_when_order_is_placed(event, make_order):
+    order = make_order()
+    order.meta_info = json.dumps({"onpremise_contact": CONTACT})
+    order.save()
+    order_placed.send(event, order=order, bulk=False)
+    assert OnPremiseContact.objects.get(order=order).formdata == CONTACT
+
+    other = make_order()
+    order_placed.send(event, order=other, bulk=False)
+    assert not OnPremiseContact.objects.filter(order=other).exists()
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_backfill_migration(make_order):
+    with_contact = make_order()
+    with_contact.meta_info = json.dumps({"onpremise_contact": CONTACT})
+    with_contact.save()
+    empty = make_order()
+    empty.meta_info = json.dumps({"onpremise_contact": {}})
+    empty.save()
+    make_order()
+
+    migration = importlib.import_module(
+        "pretix_purpletweaks.migrations.0002_backfill_onpremise_contact"
+    )
+    migration.backfill_onpremise_contact(apps, None)
+    # running it again after an interruption must not fail
+    migration.backfill_onpremise_contact(apps, None)
+    assert [c.order_id for c in OnPremiseContact.objects.all()] == [with_contact.pk]
+    assert OnPremiseContact.objects.get().formdata == CONTACT
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_layout_variables(event, make_order):
+    order = make_order()
+    OnPremiseContact.from_formdata(order, CONTACT).save()
+    position = order.positions.get()
+    variables = add_layout_text_variable(sender=event)
+
+    def evaluate(order):
+        return {
+            key: variable["evaluate"](position, order, event)
+            for key, variable in variables.items()
+        }
+
+    order = event.orders.get(pk=order.pk)
+    order.event = event
+    assert evaluate(order) == {
+        "purple_onpremise_name": "Maria Mayer",
+        "purple_onpremise_telephone": "+49 123",
+        "purple_onpremise_street": "Waldweg 1\nHinterhaus",
+        "purple_onpremise_city": "12345 Musterstadt",
+        "purple_onpremise_street_and_city": "Waldweg 1, Hinterhaus, 12345 Musterstadt",
+    }
+    # the contact is loaded and labelled once per order
+    with CaptureQueriesContext(connection) as ctx:
+        evaluate(order)
+    assert _contact_queries(ctx) == 0
+
+    other = make_order()
+    assert set(evaluate(other).values()) == {""}
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_layout_variables_query_count(event, make_order):
+    for i in range(10):
+        OnPremiseContact.from_formdata(make_order(), CONTACT).save()
+    variables = add_layout_text_variable(sender=event).values()
+
+    def render_tickets():
+        # like pretix's ticket exports, which load a new order for every position
+        positions = list(
+            OrderPosition.objects.filter(order__event=event).select_related("order")
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            for position in positions:
+                position.order.event = event
+                for variable in variables:
+                    variable["evaluate"](position, position.order, event)
+        return _contact_queries(ctx)
+
+    assert render_tickets() == 10
+    assert render_tickets() == 0
+
+    event.orders.first().purple_onpremise_contact.delete()
+    assert render_tickets() == 1
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_shredder(locmem_cache, event, make_order):
+    event.settings.onpremise_contact_availability = "always"
+    order = make_order()
+    order.meta_info = json.dumps({"onpremise_contact": CONTACT})
+    order.save()
+    OnPremiseContact.from_formdata(order, CONTACT).save()
+    order = Order.objects.select_related("event").get(pk=order.pk)
+    assert "Maria Mayer" in get_order_info_onpremise_contact(order)
+
+    shredder = OnPremiseContactShredder(event)
+    name, mimetype, data = next(shredder.generate_files())
+    assert json.loads(data) == {order.code: CONTACT}
+
+    shredder.shred_data()
+    contact = OnPremiseContact.objects.get()
+    assert contact.telephone == contact.city == contact.name_parts == "█"
+    # the panel cached for the previous modification time is gone as well
+    stale = Order.objects.select_related("event").get(pk=order.pk)
+    stale.last_modified = order.last_modified
+    assert "Maria Mayer" not in get_order_info_onpremise_contact(stale)
+    order.refresh_from_db()
+    assert json.loads(order.meta_info)["onpremise_contact"]["telephone"] == "█"
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_order_info_panel_cache(
+    locmem_cache, event, make_order, django_assert_num_queries
+):
+    event.settings.onpremise_contact_availability = "always"
+    order = make_order()
+    contact = OnPremiseContact.from_formdata(order, CONTACT)
+    contact.save()
+
+    def panel(paneltype="panel-default"):
+        fresh = Order.objects.select_related("event").get(pk=order.pk)
+        with django_assert_num_queries(0):
+            return get_order_info_onpremise_contact(fresh, paneltype)
+
+    first = get_order_info_onpremise_contact(
+        Order.objects.select_related("event").get(pk=order.pk)
+    )
+    assert "Maria Mayer" in first
+    assert panel() == first
+    assert "panel-primary" not in first
+    assert "panel-primary" in get_order_info_onpremise_contact(order, "panel-primary")
+
+    contact.telephone = "+49 456"
+    contact.save()
+    updated = get_order_info_onpremise_contact(
+        Order.objects.select_related("event").get(pk=order.pk)
+    )
+    assert "+49 456" in updated
+    assert panel() == updated
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_settings_snapshot(event, django_assert_num_queries):
+    event.settings.onpremise_contact_availability = "optional"
+    event.settings.event_page_css = "body { color: purple; }"
+    event = Event.objects.get(pk=event.pk)
+
+    conf = PurpleSettings.for_event(event)
+    assert conf.contact_availability == "optional"
+    # custom CSS is not enabled in the config, so it is not even hashed
+    assert not conf.custom_css
+    assert "custom_css_checksum" not in conf.__dict__
+    assert "cart_rules" not in conf.__dict__
+    with django_assert_num_queries(0):
+        assert PurpleSettings.for_event(event) is conf
+        assert "has_onpremise_contact" in add_additional_contact_question(event)
+        assert not conf.contact_requested({})
+        assert conf.contact_requested({"has_onpremise_contact": True})
+
+    event.settings.onpremise_contact_availability = "never"
+    PurpleSettings.invalidate(event)
+    assert not PurpleSettings.for_event(event).contact_enabled
+    assert add_additional_contact_question(event) == {}
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_shredder_export_layout(event, make_order):
+    shredder = OnPremiseContactShredder(event)
+    assert next(shredder.generate_files())[2] == "{}"
+
+    expected = {}
+    for i in range(3):
+        order = make_order()
+        contact = dict(CONTACT, telephone="+49 {}".format(i))
+        OnPremiseContact.from_formdata(order, contact).save()
+        expected[order.code] = contact
+    data = next(shredder.generate_files())[2]
+    assert data == json.dumps(expected, indent=4)
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_shredder_resumes_in_batches(event, make_order):
+    orders = [make_order() for i in range(5)]
+    for order in orders[:4]:
+        order.meta_info = json.dumps({"onpremise_contact": CONTACT})
+        order.save()
+        OnPremiseContact.from_formdata(order, CONTACT).save()
+
+    shredder = OnPremiseContactShredder(event)
+    shredder.chunk_size = 3
+
+    def interrupt(value):
+        raise RuntimeError("worker lost")
+
+    with pytest.raises(RuntimeError):
+        shredder.shred_data(progress_callback=interrupt)
+    assert OnPremiseContact.objects.filter(telephone="█").count() == 3
+
+    progress = []
+    shredder.shred_data(progress_callback=progress.append)
+    # one remaining contact, then the meta data of four orders
+    assert progress == [20, 80, 100]
+    assert set(OnPremiseContact.objects.values_list("telephone", flat=True)) == {"█"}
+    for order in orders:
+        order.refresh_from_db()
+    assert {
+        json.loads(o.meta_info)["onpremise_contact"]["city"] for o in orders[:4]
+    } == {"█"}
+    assert orders[4].meta_info is None
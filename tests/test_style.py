@@ -0,0 +1,146 @@
+import configparser
+import gzip
+import pytest
+from django.core.files.storage import default_storage
+from django.test import RequestFactory
+from django_scopes import scopes_disabled
+
+from pretix_purpletweaks.conf import PurpleSettings
+from pretix_purpletweaks.signals import presale_html_head_customcss
+from pretix_purpletweaks.style import css_checksum, minify_css, publish_custom_css
+from pretix_purpletweaks.views import PurpleSettingsForm, custom_css
+
+CSS = "body { background: purple; }"
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def enable_custom_css(settings):
+    config = configparser.ConfigParser()
+    config.read_string("[purpletweaks]\nenable_custom_css=true\n")
+    settings.CONFIG_FILE = config
+    return config
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_publish_custom_css(media, enable_custom_css, event):
+    event.settings.event_page_css = CSS
+    name = publish_custom_css(event)
+    assert name == "pub/dummy/dummy/purple.{}.css".format(css_checksum(CSS))
+    assert (media / name).read_text() == minify_css(CSS)
+    assert (
+        gzip.decompress((media / (name + ".gz")).read_bytes())
+        == minify_css(CSS).encode()
+    )
+    assert PurpleSettings(event).custom_css_file == name
+
+    # publishing unchanged CSS again keeps the file
+    assert publish_custom_css(event) == name
+
+    # a change through e.g. the API is not served from the outdated file
+    event.settings.event_page_css = CSS + " h1 { color: red; }"
+    assert PurpleSettings(event).custom_css_file is None
+    changed = publish_custom_css(event)
+    assert changed != name
+    assert not (media / name).exists()
+    assert not (media / (name + ".gz")).exists()
+
+    event.settings.event_page_css = ""
+    assert publish_custom_css(event) is None
+    assert not (media / changed).exists()
+    assert event.settings.get("purple_css_file") is None
+
+    # nothing is left in the public storage while custom CSS is disabled
+    event.settings.event_page_css = CSS
+    name = publish_custom_css(event)
+    enable_custom_css.set("purpletweaks", "enable_custom_css", "false")
+    assert publish_custom_css(event) is None
+    assert not (media / name).exists()
+    assert event.settings.get("purple_css_file") is None
+    assert publish_custom_css(event) is None
+    assert not list(media.rglob("*.css*"))
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_custom_css_fallback_view(event):
+    event.settings.event_page_css = CSS
+    request = RequestFactory().get("/custom.css")
+    request.event = event
+    response = custom_css(request)
+    assert response.status_code == 200
+    assert response.content.decode() == minify_css(CSS)
+    assert response["ETag"] == '"{}"'.format(css_checksum(CSS))
+    assert "max-age" in response["Cache-Control"]
+
+    request = RequestFactory().get("/custom.css", HTTP_IF_NONE_MATCH=response["ETag"])
+    request.event = event
+    assert custom_css(request).status_code == 304
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_html_head_links_published_file(media, enable_custom_css, event):
+    event.settings.event_page_css = CSS
+
+    head = presale_html_head_customcss(event, request=None)
+    assert "custom.css?v={}".format(css_checksum(CSS)) in head
+
+    name = publish_custom_css(event)
+    PurpleSettings.invalidate(event)
+    head = presale_html_head_customcss(event, request=None)
+    assert default_storage.url(name) in head
+    assert "custom.css" not in head
+
+
+def test_minify_css():
+    css = """
+    /* theme */
+    a { color : red ; }
+    b {}
+    @media print { c { } }
+    d:after { content: "{}"; }
+    /*! license */
+    e { }
+    """
+    assert minify_css(css) == 'a{color:red}d:after{content:"{}"}/*! license */'
+
+    # braces in strings and url() are not rules
+    for css in [
+        'a{content:"x{}"}',
+        "a{content:'\\'{}'}",
+        "b{background:url(data:image/svg+xml;utf8,<svg><style>p{}</style></svg>)}",
+        'b{background:url("data:x{}")}',
+    ]:
+        assert minify_css(css) == css
+    assert minify_css('a[href="{}"] {} /*! it\'s */ b {}') == "/*! it's */"
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_settings_form_css_budget(settings, event):
+    config = configparser.ConfigParser()
+    config.read_string("[purpletweaks]\ncustom_css_max_bytes=32\n")
+    settings.CONFIG_FILE = config
+
+    def form(css):
+        return PurpleSettingsForm(
+            obj=event,
+            data={"onpremise_contact_availability": "never", "event_page_css": css},
+        )
+
+    small = form("/* a long comment that is dropped */\n" + CSS)
+    assert small.is_valid()
+    assert small.event_page_css_sizes == (len(small.data["event_page_css"]), 23)
+    # the source is kept as entered, only the published file is minified
+    assert small.cleaned_data["event_page_css"] == small.data["event_page_css"]
+
+    large = form(CSS + " h1 { color: red; }")
+    assert not large.is_valid()
+    assert "at most 32 bytes" in large.errors["event_page_css"][0]
@@ -0,0 +1,134 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from django.core.management import call_command
+from django_scopes import scopes_disabled
+from io import StringIO
+from pretix.base.models import Event, Order, OrderPayment
+
+from pretix_purpletweaks.payment import PurpleManualPayment1
+from pretix_purpletweaks.signals import recompute_expires_periodically
+from pretix_purpletweaks.tasks import recompute_expires
+
+PLACED = datetime(2030, 5, 1, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+@scopes_disabled()
+def series(organizer):
+    event = Event.objects.create(
+        organizer=organizer,
+        name="Series",
+        slug="series",
+        date_from=datetime(2030, 6, 1, 10, tzinfo=timezone.utc),
+        has_subevents=True,
+        plugins="pretix_purpletweaks",
+    )
+    event.settings.timezone = "UTC"
+    return event
+
+
+@pytest.fixture
+@scopes_disabled()
+def make_series_order(series):
+    item = series.items.create(name="Ticket", default_price=Decimal("10.00"))
+    counter = iter(range(1000))
+
+    def make(subevents, provider="purple_manual", status=Order.STATUS_PENDING):
+        i = next(counter)
+        order = Order.objects.create(
+            event=series,
+            code="EXP{:04d}".format(i),
+            status=status,
+            email="dummy{}@example.org".format(i),
+            datetime=PLACED,
+            expires=PLACED,
+            total=item.default_price,
+            sales_channel=series.organizer.sales_channels.get(identifier="web"),
+        )
+        order.payments.create(
+            provider=provider,
+            amount=order.total,
+            state=OrderPayment.PAYMENT_STATE_CREATED,
+        )
+        for subevent in subevents:
+            order.positions.create(
+                item=item, price=item.default_price, subevent=subevent
+            )
+        return order
+
+    return make
+
+
+def _set_rule(event, rule):
+    PurpleManualPayment1(event).settings.set("_overwrite_expires", rule)
+    event.__dict__.pop("_purple_payment_matrix", None)
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_recompute_expires(series, make_series_order, django_assert_max_num_queries):
+    early = series.subevents.create(name="Early", date_from=series.date_from)
+    late = series.subevents.create(
+        name="Late", date_from=series.date_from + timedelta(days=10)
+    )
+    orders = [make_series_order([early, late]) for i in range(5)]
+    orders.append(make_series_order([early]))
+    other_provider = make_series_order([early], provider="manual")
+    paid = make_series_order([early], status=Order.STATUS_PAID)
+
+    assert recompute_expires(series) == (0, 0)
+
+    _set_rule(series, "DATEDIFF/3/before_event/")
+    assert recompute_expires(series, dry_run=True) == (6, 6)
+    assert Order.objects.filter(expires=PLACED).count() == 8
+
+    # the last date of every order is resolved in the query, not per order
+    with django_assert_max_num_queries(6):
+        assert recompute_expires(series, batch_size=2) == (6, 6)
+    expires = {o.pk: o.expires for o in Order.objects.all()}
+    for order in orders[:5]:
+        assert expires[order.pk] == datetime(
+            2030, 6, 8, 23, 59, 59, tzinfo=timezone.utc
+        )
+    assert expires[orders[5].pk] == datetime(
+        2030, 5, 29, 23, 59, 59, tzinfo=timezone.utc
+    )
+    assert expires[other_provider.pk] == expires[paid.pk] == PLACED
+
+    # the rule is applied just like when the payment is created
+    assert recompute_expires(series) == (6, 0)
+
+    _set_rule(series, "DATEDIFF/14/after_order/")
+    out = StringIO()
+    call_command("purple_recompute_expires", "dummy", "series", "--dry-run", stdout=out)
+    assert out.getvalue().strip() == "6 of 6 pending orders would change."
+    call_command("purple_recompute_expires", "dummy", "series", stdout=out)
+    assert Order.objects.get(pk=orders[5].pk).expires == datetime(
+        2030, 5, 15, 23, 59, 59, tzinfo=timezone.utc
+    )
+
+
+@pytest.mark.django_db
+@scopes_disabled()
+def test_recompute_expires_periodically(series, make_series_order):
+    subevent = series.subevents.create(name="Date", date_from=series.date_from)
+    order = make_series_order([subevent])
+    _set_rule(series, "DATEDIFF/3/before_event/")
+
+    # the first run leaves dates that may have been changed by hand alone
+    recompute_expires_periodically(None)
+    order.refresh_from_db()
+    assert order.expires == PLACED
+
+    subevent.date_from += timedelta(days=7)
+    subevent.save()
+    recompute_expires_periodically(None)
+    order.refresh_from_db()
+    assert order.expires == datetime(2030, 6, 5, 23, 59, 59, tzinfo=timezone.utc)
+
+    order.expires = PLACED
+    order.save()
+    recompute_expires_periodically(None)
+    order.refresh_from_db()
+    assert order.expires == PLACED